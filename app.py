@@ -1,14 +1,42 @@
 import os
-from flask import Flask, request, abort, jsonify, redirect
+from datetime import date
+from collections import Counter
+from flask import Flask, request, abort, redirect
+from flask import Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from models import setup_db, Actor, Movie, association_table, db
-from auth.auth import AuthError, requires_auth
+from models import add_assignment, remove_assignment, movie_and_actor_exist
+from models import add_assignments, bulk_insert
+from models import update_row, delete_row, row_exists
+from auth.auth import AuthError, requires_auth, permission_registry
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from dto import actor_page, movie_page
+from filters import actor_filters, actor_sort, movie_filters, movie_sort
+from filters import get_int_arg
+from casting import validate_role, match_actors
+from conflicts import find_conflicts, find_all_conflicts
+from conflicts import CONFLICT_WINDOW_DAYS, CONFLICT_MODES, CONFLICT_MODE
+from costars import costar_store
+from stats import stats_cache
+from streaming import wants_stream, ndjson_response
+from serialization import json_response
+from catalog_export import TABLES, FORMATS, export_table
+from response_cache import response_cache, EPOCH_TAG
+from etags import conditional, actor_etag, movie_etag, catalog_etag
+from etags import expected_version
 
 
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 API_AUDIENCE = os.environ['API_AUDIENCE']
 AUTH0_CLIENT_ID = os.environ['AUTH0_CLIENT_ID']
+# Maximum number of items accepted by the bulk endpoints
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+# Level of the app logger, Flask leaves it at WARNING outside debug mode
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
 '''
     return True if one of it's arguments is None
@@ -21,10 +49,142 @@ def is_none(*args):
     return False
 
 
+'''
+    return True if value can be used as a row id
+'''
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+'''
+    validate an actor of a bulk request,
+    return the columns to insert or None if it's invalid
+'''
+
+
+def validate_actor(item, with_id=False):
+    if not isinstance(item, dict):
+        return None
+    name, age, gender = item.get('name'), item.get('age'), item.get('gender')
+    if not isinstance(name, str) or not 0 < len(name) <= 250 or \
+            not is_id(age) or not isinstance(gender, str):
+        return None
+    row = {'name': name, 'age': age, 'gender': gender}
+    if with_id:
+        if not is_id(item.get('id')):
+            return None
+        row['id'] = item.get('id')
+    return row
+
+
+'''
+    validate a movie of a bulk request,
+    return the columns to insert or None if it's invalid
+'''
+
+
+def validate_movie(item, with_id=False):
+    if not isinstance(item, dict):
+        return None
+    title, release_date = item.get('title'), item.get('release_date')
+    if not isinstance(title, str) or not 0 < len(title) <= 250 or \
+            not isinstance(release_date, str):
+        return None
+    try:
+        release_date = date.fromisoformat(release_date)
+    except ValueError:
+        return None
+    row = {'title': title, 'release_date': release_date}
+    if with_id:
+        if not is_id(item.get('id')):
+            return None
+        row['id'] = item.get('id')
+    return row
+
+
+'''
+    validate every item of a bulk request before writing anything,
+    return the rows or the indexes of the invalid items. An upsert
+    can't write the same id twice, items sharing an id are invalid
+'''
+
+
+def validate_bulk(items, validate, upsert_on):
+    if not isinstance(items, list) or not 0 < len(items) <= BULK_MAX_ITEMS:
+        abort(400)  # bad request
+    if upsert_on not in (None, 'id'):
+        abort(400)  # bad request
+
+    rows = [validate(item, with_id=upsert_on == 'id') for item in items]
+    if upsert_on == 'id':
+        ids = Counter(row['id'] for row in rows if row is not None)
+        invalid = [index for index, row in enumerate(rows)
+                   if row is None or ids[row['id']] > 1]
+    else:
+        invalid = [index for index, row in enumerate(rows) if row is None]
+    return rows, invalid
+
+
+'''
+    tags of an actor or a movie written through the ORM
+'''
+
+
+def instance_tags(instance):
+    if isinstance(instance, Actor):
+        return ['catalog', f'actor:{instance.id}']
+    if isinstance(instance, Movie):
+        return ['catalog', f'movie:{instance.id}']
+    return []
+
+
+'''
+    invalidate the cached responses of (movie_id, actor_id) pairs
+    once the transaction commits
+'''
+
+
+def invalidate_pairs(pairs):
+    tags = {'catalog'}
+    for movie_id, actor_id in pairs:
+        tags.update([f'movie:{movie_id}', f'actor:{actor_id}'])
+    response_cache.invalidate_on_commit(db.session, *tags)
+
+
+'''
+    format an actor with the actor's movies for the list endpoints
+'''
+
+
+def format_actor(actor):
+    return {
+        "actor's_information": actor.format(),
+        "actor's_movies": actor.get_movies()
+    }
+
+
+'''
+    format a movie with the movie's actors for the list endpoints
+'''
+
+
+def format_movie(movie):
+    return {
+        "movie's_information": movie.format(),
+        "movie's_movies": movie.get_actors()
+    }
+
+
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    # emit the info lines (export throughput) outside debug mode too
+    if not app.debug:
+        app.logger.setLevel(LOG_LEVEL)
     setup_db(app)
+    response_cache.init_session(db.session, instance_tags)
     CORS(app, resources={r"/*": {"origins": "*"}})
     '''
     Set Access-Control-Allow Headers
@@ -55,7 +215,7 @@ def create_app(test_config=None):
 
     @app.route('/callback')
     def message():
-        return jsonify({'message': 'Copy the access token from the URL'})
+        return json_response({'message': 'Copy the access token from the URL'})
 # ---- Actor Endpoints ----
 
     '''
@@ -63,21 +223,34 @@ def create_app(test_config=None):
     '''
     @app.route('/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @conditional(catalog_etag, weak=True)
+    @response_cache.cached(lambda: ['catalog'], unless=wants_stream)
     def get_actors(token):
+        # Only the actors that match the query string filters
+        filters = actor_filters()
+        columns, descending = actor_sort()
+
+        # Stream every actor if the client asked for the whole catalog
+        if wants_stream():
+            return ndjson_response(
+                Actor.with_movies().filter(*filters).order_by(
+                    *[column.desc() if descending else column
+                      for column in columns]), format_actor)
+
+        # Get one page of actors with their movies, read without the ORM
+        actors, next_cursor = actor_page(filters, columns, descending)
+
         try:
-            actors = Actor.query.all()  # Get all actors in the database
             data = []
 
             for actor in actors:
                 # format actor information
-                data.append({
-                    "actor's_information": actor.format(),
-                    "actor's_movies": actor.get_movies()
-                })
+                data.append(format_actor(actor))
 
-            return jsonify({
+            return json_response({
                 'success': True,
-                'actors': data
+                'actors': data,
+                'next_cursor': next_cursor
             })
 
         except Exception:
@@ -89,14 +262,16 @@ def create_app(test_config=None):
 
     @app.route('/actors/<int:id>', methods=['GET'])
     @requires_auth('get:actors')
+    @conditional(actor_etag)
+    @response_cache.cached(lambda id: [f'actor:{id}'])
     def get_actor(token, id=id):
-        # Retrive the actor from the database
-        actor = Actor.query.filter(Actor.id == id).one_or_none()
+        # Retrive the actor and the actor's movies from the database
+        actor = Actor.with_movies().filter(Actor.id == id).one_or_none()
 
         if is_none(actor):  # Check if the actor is not exist
             abort(404)  # not found
 
-        return jsonify({
+        return json_response({
             'success': True,
             "actor's_information": actor.format(),
             "actor's_movies": actor.get_movies()
@@ -107,21 +282,32 @@ def create_app(test_config=None):
     @app.route('/actors/<int:id>', methods=['DELETE'])
     @requires_auth('delete:actor')
     def delete_actor(token, id=id):
-        # Retrive the actor from the database
-        actor = Actor.query.filter(Actor.id == id).one_or_none()
-
-        if is_none(actor):  # Check if the actor is not exist
-            abort(404)  # not found
-
         try:
-            actor.delete()
-            return jsonify({
-                'success': True,
-                'deleted': id
-            })
+            # Delete the actor and get the actor's movies in one statement
+            deleted, movie_ids = delete_row(
+                Actor, id,
+                related=(association_table.c.actor_id,
+                         association_table.c.movie_id))
+
+            if deleted:
+                response_cache.invalidate_on_commit(
+                    db.session, 'catalog', f'actor:{id}',
+                    *[f'movie:{movie_id}' for movie_id in movie_ids])
+            db.session.commit()
 
         except Exception:
+            db.session.rollback()
             abort(422)  # unprocessable
+
+        if not deleted:  # Check if the actor is not exist
+            abort(404)  # not found
+
+        costar_store.unassigned([(movie_id, id) for movie_id in movie_ids])
+
+        return json_response({
+            'success': True,
+            'deleted': id
+        })
     '''
         route handler to add new actor
     '''
@@ -150,7 +336,7 @@ def create_app(test_config=None):
 
             new_actor.insert()
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'actor': new_actor.format()
             })
@@ -158,42 +344,93 @@ def create_app(test_config=None):
         except Exception:
             abort(422)  # unprocessable
     '''
-        route handler to edit actor information
+        route handler to add (or update) many actors in one request
     '''
-    @app.route('/actors/<int:id>', methods=['PATCH'])
-    @requires_auth('edit:actor')
-    def edit_actor_data(token, id=id):
-        # Retrive the actor from the database
-        actor = Actor.query.filter(Actor.id == id).one_or_none()
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('add:actor')
+    def add_actors(token):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)  # bad request
 
-        if is_none(actor):  # Check if the actor is not exist
-            abort(404)  # not found
+        if is_none(body.get('actors')):
+            abort(401)  # bad request
+
+        actors, invalid = validate_bulk(
+            body.get('actors'), validate_actor, body.get('upsert_on'))
+
+        if invalid:  # Nothing is written if any actor is invalid
+            return json_response({
+                'success': False,
+                'error': 400,
+                'message': 'Bad request',
+                'invalid': invalid
+            }), 400
 
         try:
+            # an upsert can change any actor
+            response_cache.invalidate_on_commit(
+                db.session, 'catalog',
+                *([EPOCH_TAG] if body.get('upsert_on') else []))
+            actors = bulk_insert(Actor, actors, body.get('upsert_on'))
 
-            body = request.get_json()
-            '''
-                Check what information are included in the request body,
-                and edit the actor based on it
-            '''
-            if not is_none(body.get('name')):
-                actor.name = body.get('name')
+            return json_response({
+                'success': True,
+                'actors': actors
+            })
 
-            if not is_none(body.get('age')):
-                actor.age = body.get('age')
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
+    '''
+        route handler to edit actor information
+    '''
+    @app.route('/actors/<int:id>', methods=['PATCH'])
+    @requires_auth('edit:actor')
+    def edit_actor_data(token, id=id):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)  # bad request
+        # The version the client edited, from If-Match
+        version = expected_version('actor', id)
 
-            if not is_none(body.get('gender')):
-                actor.gender = body.get('gender')
+        '''
+            Check what information are included in the request body,
+            and edit the actor based on it
+        '''
+        values = {}
+        for column in ('name', 'age', 'gender'):
+            if not is_none(body.get(column)):
+                values[column] = body.get(column)
 
-            actor.update()
+        try:
+            # Update the actor and get the actor's movies in one statement
+            actor, movie_ids = update_row(
+                Actor, id, values, version,
+                related=(association_table.c.actor_id,
+                         association_table.c.movie_id))
+
+            if not is_none(actor):
+                response_cache.invalidate_on_commit(
+                    db.session, 'catalog', f'actor:{id}',
+                    *[f'movie:{movie_id}' for movie_id in movie_ids])
+            db.session.commit()
 
-            return jsonify({
-                'success': True,
-                'actor': actor.format()
-            })
         except Exception:
+            db.session.rollback()
             abort(422)  # unprocessable
 
+        if is_none(actor):
+            # Check if the actor is not exist or was edited since
+            if is_none(version) or not row_exists(Actor, id):
+                abort(404)  # not found
+            abort(412)  # precondition failed
+
+        return json_response({
+            'success': True,
+            'actor': actor
+        })
+
     # ----- Movies Endpoints -----
 
     '''
@@ -201,21 +438,34 @@ def create_app(test_config=None):
     '''
     @app.route('/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @conditional(catalog_etag, weak=True)
+    @response_cache.cached(lambda: ['catalog'], unless=wants_stream)
     def get_movies(token):
+        # Only the movies that match the query string filters
+        filters = movie_filters()
+        columns, descending = movie_sort()
+
+        # Stream every movie if the client asked for the whole catalog
+        if wants_stream():
+            return ndjson_response(
+                Movie.with_actors().filter(*filters).order_by(
+                    *[column.desc() if descending else column
+                      for column in columns]), format_movie)
+
+        # Get one page of movies with their actors, read without the ORM
+        movies, next_cursor = movie_page(filters, columns, descending)
+
         try:
-            movies = Movie.query.all()  # Get all movies in the database
             data = []
 
             for movie in movies:
                 # format movie information
-                data.append({
-                    "movie's_information": movie.format(),
-                    "movie's_movies": movie.get_actors()
-                })
+                data.append(format_movie(movie))
 
-            return jsonify({
+            return json_response({
                 'success': True,
-                'movies': data
+                'movies': data,
+                'next_cursor': next_cursor
             })
 
         except Exception:
@@ -225,14 +475,16 @@ def create_app(test_config=None):
     '''
     @app.route('/movies/<int:id>', methods=['GET'])
     @requires_auth('get:movies')
+    @conditional(movie_etag)
+    @response_cache.cached(lambda id: [f'movie:{id}'])
     def get_movie(token, id=id):
-        # Retrive the movie from the database
-        movie = Movie.query.filter(Movie.id == id).one_or_none()
+        # Retrive the movie and the movie's actors from the database
+        movie = Movie.with_actors().filter(Movie.id == id).one_or_none()
 
         if is_none(movie):  # Check if the movie is not exist
             abort(404)  # not found
 
-        return jsonify({
+        return json_response({
             'success': True,
             'movie_information': movie.format(),
             "movie's_actors": movie.get_actors()
@@ -244,24 +496,33 @@ def create_app(test_config=None):
     @app.route('/movies/<int:id>', methods=['DELETE'])
     @requires_auth('delete:movie')
     def delete_movie(token, id=id):
-        # Retrive the movie from the database
-        movie = Movie.query.filter(Movie.id == id).one_or_none()
-
-        if is_none(movie):  # Check if the movie is not exist
-            abort(404)  # not found
-
         try:
-
-            movie.delete()
-
-            return jsonify({
-                'success': True,
-                'deleted': id
-            })
+            # Delete the movie and get the movie's actors in one statement
+            deleted, actor_ids = delete_row(
+                Movie, id,
+                related=(association_table.c.movie_id,
+                         association_table.c.actor_id))
+
+            if deleted:
+                response_cache.invalidate_on_commit(
+                    db.session, 'catalog', f'movie:{id}',
+                    *[f'actor:{actor_id}' for actor_id in actor_ids])
+            db.session.commit()
 
         except Exception:
+            db.session.rollback()
             abort(422)  # unprocessable
 
+        if not deleted:  # Check if the movie is not exist
+            abort(404)  # not found
+
+        costar_store.unassigned([(id, actor_id) for actor_id in actor_ids])
+
+        return json_response({
+            'success': True,
+            'deleted': id
+        })
+
     '''
         route handler to add new movie
     '''
@@ -289,7 +550,7 @@ def create_app(test_config=None):
 
             new_movie.insert()
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'movie': new_movie.format(),
                 "movie's_actors": new_movie.get_actors()
@@ -298,6 +559,46 @@ def create_app(test_config=None):
         except Exception:
             abort(422)  # unprocessable
 
+    '''
+        route handler to add (or update) many movies in one request
+    '''
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('add:movie')
+    def add_movies(token):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)  # bad request
+
+        if is_none(body.get('movies')):
+            abort(401)  # bad request
+
+        movies, invalid = validate_bulk(
+            body.get('movies'), validate_movie, body.get('upsert_on'))
+
+        if invalid:  # Nothing is written if any movie is invalid
+            return json_response({
+                'success': False,
+                'error': 400,
+                'message': 'Bad request',
+                'invalid': invalid
+            }), 400
+
+        try:
+            # an upsert can change any movie
+            response_cache.invalidate_on_commit(
+                db.session, 'catalog',
+                *([EPOCH_TAG] if body.get('upsert_on') else []))
+            movies = bulk_insert(Movie, movies, body.get('upsert_on'))
+
+            return json_response({
+                'success': True,
+                'movies': movies
+            })
+
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
+
     '''
         route handler to edit movie information
     '''
@@ -305,32 +606,49 @@ def create_app(test_config=None):
     @app.route('/movies/<int:id>', methods=['PATCH'])
     @requires_auth('edit:movie')
     def edit_movie_data(token, id=id):
-        # Retrive the movie from the database
-        movie = Movie.query.filter(Movie.id == id).one_or_none()
-
-        if is_none(movie):  # Check if the movie is not exist
-            abort(404)  # not found
-        try:
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)  # bad request
+        # The version the client edited, from If-Match
+        version = expected_version('movie', id)
 
-            body = request.get_json()
-            '''
-                Check what information are included in the request body,
-                and edit the movie based on it
-            '''
-            if not is_none(body.get('title')):
-                movie.title = body.get('title')
+        '''
+            Check what information are included in the request body,
+            and edit the movie based on it
+        '''
+        values = {}
+        for column in ('title', 'release_date'):
+            if not is_none(body.get(column)):
+                values[column] = body.get(column)
 
-            if not is_none(body.get('release_date')):
-                movie.release_date = body.get('release_date')
+        try:
+            # Update the movie and get the movie's actors in one statement
+            movie, actor_ids = update_row(
+                Movie, id, values, version,
+                related=(association_table.c.movie_id,
+                         association_table.c.actor_id))
+
+            if not is_none(movie):
+                response_cache.invalidate_on_commit(
+                    db.session, 'catalog', f'movie:{id}',
+                    *[f'actor:{actor_id}' for actor_id in actor_ids])
+            db.session.commit()
 
-            movie.update()
-            return jsonify({
-                'success': True,
-                'movie': movie.format()
-            })
         except Exception:
+            db.session.rollback()
             abort(422)  # unprocessable
 
+        if is_none(movie):
+            # Check if the movie is not exist or was edited since
+            if is_none(version) or not row_exists(Movie, id):
+                abort(404)  # not found
+            abort(412)  # precondition failed
+
+        return json_response({
+            'success': True,
+            'movie': movie
+        })
+
     # ---- Assign ----
     '''
         Assign Endpoint add relationship between actor and movie
@@ -353,27 +671,62 @@ def create_app(test_config=None):
         actor_id = body.get('actor_id')
         movie_id = body.get('movie_id')
 
+        # check the actor's schedule when asked (off, flag or reject)
+        mode = body.get('conflicts', CONFLICT_MODE)
+        if mode not in CONFLICT_MODES:
+            abort(400)  # bad request
+
+        # the check locks the actor until the assignment is committed
+        conflicts = []
+        if mode != 'off':
+            try:
+                conflicts = find_conflicts(movie_id, actor_id)
+
+            except Exception:
+                db.session.rollback()
+                abort(422)  # unprocessable
+
+        if mode == 'reject' and conflicts:
+            db.session.rollback()
+            return json_response({
+                'success': False,
+                'error': 409,
+                'message': 'Conflict',
+                'conflicts': conflicts
+            }), 409
+
         '''
-        Retrive the Movie and The Actor from the database
+        Insert the relationship, the foreign keys reject
+        a Movie or an Actor that doesn't exist
         '''
 
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        try:
+            invalidate_pairs([(movie_id, actor_id)])
+            assigned = add_assignment(movie_id, actor_id)
 
-        if is_none(actor, movie):  # Check if any of them is not exist
+        except IntegrityError:
+            db.session.rollback()
             abort(404)  # not found
 
-        try:
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
 
-            movie.add_actor(actor)
+        if assigned:
+            costar_store.assigned([(movie_id, actor_id)])
 
-            return jsonify({
-                'success': True,
-                "movie's_actor": movie.get_actors()
-            })
+        response = {
+            'success': True,
+            "movie's_actor": {
+                'movie_id': movie_id,
+                'actor_id': actor_id,
+                'assigned': assigned
+            }
+        }
+        if mode == 'flag':
+            response['conflicts'] = conflicts
 
-        except Exception:
-            abort(422)  # unprocessable
+        return json_response(response)
 
     '''
         Assign:Delete Endpoint remove relationship between actor and movie
@@ -398,32 +751,264 @@ def create_app(test_config=None):
         movie_id = body.get('movie_id')
 
         '''
-        Retrive the Movie and The Actor from the database
+        Delete the relationship, the Movie and the Actor are only
+        looked up when there was nothing to delete
+        '''
+
+        try:
+            invalidate_pairs([(movie_id, actor_id)])
+            unassigned = remove_assignment(movie_id, actor_id)
+            found = unassigned or movie_and_actor_exist(movie_id, actor_id)
+
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
+
+        if not found:  # Check if any of them is not exist
+            abort(404)  # not found
+
+        if unassigned:
+            costar_store.unassigned([(movie_id, actor_id)])
+
+        return json_response({
+            'success': True,
+            "movie's_actor": {
+                'movie_id': movie_id,
+                'actor_id': actor_id,
+                'unassigned': unassigned
+            }
+        })
+
+    '''
+        Assign:Bulk Endpoint add many relationships in one request,
+        accepts a list of pairs or one movie with a list of actors
+    '''
+
+    @app.route('/assign/bulk', methods=['POST'])
+    @requires_auth('edit:movie')
+    def assign_actors(token):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(400)  # bad request
+
+        '''
+            Build the (movie_id, actor_id) pairs from the request
         '''
 
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        if not is_none(body.get('pairs')):
+            if not isinstance(body.get('pairs'), list) or not all(
+                    isinstance(pair, dict) for pair in body.get('pairs')):
+                abort(400)  # bad request
+            pairs = [(pair.get('movie_id'), pair.get('actor_id'))
+                     for pair in body.get('pairs')]
+        elif not is_none(body.get('movie_id'), body.get('actor_ids')):
+            if not isinstance(body.get('actor_ids'), list):
+                abort(400)  # bad request
+            pairs = [(body.get('movie_id'), actor_id)
+                     for actor_id in body.get('actor_ids')]
+        else:
+            abort(401)  # bad request
 
-        if is_none(actor, movie):  # Check if any of them is not exist
-            abort(404)
+        '''
+            Check the size of the request and the ids
+        '''
+
+        if len(pairs) == 0 or len(pairs) > BULK_MAX_ITEMS:
+            abort(400)  # bad request
+
+        for movie_id, actor_id in pairs:
+            if not is_id(movie_id) or not is_id(actor_id):
+                abort(400)  # bad request
 
         try:
+            invalidate_pairs(pairs)
+            results = add_assignments(pairs)
+
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
 
-            movie.delete_actor(actor)
+        costar_store.assigned([
+            (result['movie_id'], result['actor_id']) for result in results
+            if result['status'] == 'assigned'])
 
-            return jsonify({
-                'success': True,
-                "movie's_actor": movie.get_actors()
-            })
+        return json_response({
+            'success': True,
+            'results': results
+        })
+
+    '''
+        Conflicts Endpoint report every pair of movies of an actor
+        that release within the conflict window, page by page
+    '''
+
+    @app.route('/conflicts', methods=['GET'])
+    @requires_auth('get:movies')
+    def get_conflicts(token):
+        window = get_int_arg('window_days')
+        if is_none(window):
+            window = CONFLICT_WINDOW_DAYS
+
+        try:
+            conflicts, next_cursor = find_all_conflicts(window)
 
         except Exception:
             abort(422)  # unprocessable
 
+        return json_response({
+            'success': True,
+            'conflicts': conflicts,
+            'next_cursor': next_cursor
+        })
+
+    # ---- Co-stars ----
+    '''
+        Co-stars Endpoint the actors who worked with an actor,
+        the most shared movies first
+    '''
+
+    @app.route('/actors/<int:id>/co-stars', methods=['GET'])
+    @requires_auth('get:actors')
+    def get_co_stars(token, id=id):
+        limit = get_int_arg('limit')
+        if is_none(limit):
+            limit = DEFAULT_PAGE_SIZE
+        if limit == 0:
+            abort(400)  # bad request
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        if not row_exists(Actor, id):  # Check if the actor is not exist
+            abort(404)  # not found
+
+        try:
+            co_stars = costar_store.graph().co_stars(id, limit)
+
+            # the names of the ranked actors in one query
+            names = dict(db.session.query(Actor.id, Actor.name).filter(
+                Actor.id.in_([actor_id for actor_id, shared in co_stars])))
+
+        except Exception:
+            abort(422)  # unprocessable
+
+        return json_response({
+            'success': True,
+            'actor_id': id,
+            'co_stars': [{
+                'id': actor_id,
+                'name': names.get(actor_id),
+                'shared_movies': shared
+            } for actor_id, shared in co_stars if actor_id in names]
+        })
+
+    '''
+        Path Endpoint the shortest chain of movies and co-stars
+        between two actors (degrees of separation)
+    '''
+
+    @app.route('/actors/<int:id>/path/<int:other_id>', methods=['GET'])
+    @requires_auth('get:actors')
+    def get_path(token, id, other_id):
+        found = db.session.query(func.count(Actor.id)).filter(
+            Actor.id.in_([id, other_id])).scalar()
+
+        if found < len({id, other_id}):  # Check if any of them is not exist
+            abort(404)  # not found
+
+        try:
+            path = costar_store.graph().path(id, other_id)
+
+        except Exception:
+            abort(422)  # unprocessable
+
+        actors, movies = path if not is_none(path) else ([], [])
+
+        return json_response({
+            'success': True,
+            'degrees': len(movies) if not is_none(path) else None,
+            'actors': actors,
+            'movies': movies
+        })
+
+    # ---- Stats ----
+    '''
+        Stats Endpoint the distributions of the catalog for the
+        dashboards, recomputed at most every STATS_TTL seconds
+    '''
+
+    @app.route('/stats', methods=['GET'])
+    @requires_auth('get:movies')
+    def get_stats(token):
+        try:
+            stats, computed_at = stats_cache.get()
+
+        except Exception:
+            db.session.rollback()
+            abort(422)  # unprocessable
+
+        return json_response({
+            'success': True,
+            'stats': stats,
+            'computed_at': int(computed_at)
+        })
+
+    # ---- Casting ----
+    '''
+        Casting:Match Endpoint rank the actors that fit a role spec
+    '''
+
+    @app.route('/casting/match', methods=['POST'])
+    @requires_auth('get:actors')
+    def match_casting(token):
+        role = validate_role(request.get_json())
+
+        if is_none(role):  # Check the role spec
+            abort(400)  # bad request
+
+        try:
+            candidates = match_actors(role)
+
+        except Exception:
+            abort(422)  # unprocessable
+
+        return json_response({
+            'success': True,
+            'candidates': candidates
+        })
+
+    # ---- Export ----
+    '''
+        Export Endpoint stream a whole table of the catalog
+        as csv, ndjson or columnar
+    '''
+
+    @app.route('/export/<table>', methods=['GET'])
+    @requires_auth('export:catalog')
+    def export_catalog(token, table):
+        format = request.args.get('format', 'csv')
+
+        if table not in TABLES:
+            abort(404)  # not found
+
+        if format not in FORMATS:
+            abort(400)  # bad request
+
+        stats = {}
+
+        def generate():
+            for chunk in export_table(table, format, stats=stats):
+                yield chunk
+            app.logger.info('exported %s rows of %s in %.1fs (%d rows/s)',
+                            stats['rows'], table, stats['seconds'],
+                            stats['rows_per_second'])
+
+        return Response(stream_with_context(generate()),
+                        mimetype=FORMATS[format])
+
     # ---- Error Handlers ----
 
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "error": 422,
             "message": "unprocessable"
@@ -431,7 +1016,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(404)
     def notfound(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 404,
             'message': 'not found',
@@ -439,15 +1024,24 @@ def create_app(test_config=None):
 
     @app.errorhandler(401)
     def notfound(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 401,
             'message': 'Unauthorized',
         }), 401
 
+    @app.errorhandler(412)
+    @app.errorhandler(StaleDataError)
+    def precondition_failed(error):
+        return json_response({
+            'success': False,
+            'error': 412,
+            'message': 'Precondition failed',
+        }), 412
+
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 400,
             'message': 'Bad request',
@@ -455,11 +1049,17 @@ def create_app(test_config=None):
 
     @app.errorhandler(AuthError)
     def unauthorized(error):
-        return jsonify({
+        # a token the API can't accept is 401, an outage of the
+        # identity provider (no signing keys) keeps its 5xx status
+        status = error.status_code if error.status_code >= 500 else 401
+        return json_response({
             'success': False,
-            'error': 401,
+            'error': status,
             'message': error.error['description'],
-        }), 401
+        }), status
+
+    app.logger.info('Registered scopes: %s',
+                    ', '.join(permission_registry.scopes()))
 
     return app
 
@@ -1,5 +1,9 @@
+import hashlib
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
@@ -10,6 +14,20 @@ AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = ['RS256']
 API_AUDIENCE = os.environ['API_AUDIENCE']
 
+# How long (seconds) the JWKS document is trusted before it is refetched
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 3600))
+# Minimum interval (seconds) between refreshes forced by an unknown kid
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+# Timeout (seconds) for the request to the JWKS endpoint
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+# Wait (seconds) before retrying a failed fetch, doubled on every
+# failure in a row up to JWKS_MAX_RETRY_BACKOFF
+JWKS_RETRY_BACKOFF = int(os.environ.get('JWKS_RETRY_BACKOFF', 5))
+JWKS_MAX_RETRY_BACKOFF = int(os.environ.get('JWKS_MAX_RETRY_BACKOFF', 300))
+# Maximum number of verified tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -23,6 +41,298 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# JWKS Key Store
+'''
+JWKSStore
+Keeps the Auth0 signing keys in memory indexed by kid, so verifying a
+token does not need a round trip to Auth0.
+    - the document is refetched in the background once it is older
+      than ttl, requests keep using the keys they already have
+    - only one thread refetches at a time
+    - an unknown kid forces a refetch, at most once per
+      min_refresh_interval
+    - if Auth0 can't be reached the last known keys keep being served
+      and the next fetch waits for retry_backoff, doubled on every
+      failure in a row up to max_retry_backoff
+'''
+
+
+class JWKSStore:
+    def __init__(self, url, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT,
+                 retry_backoff=JWKS_RETRY_BACKOFF,
+                 max_retry_backoff=JWKS_MAX_RETRY_BACKOFF):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._keys = {}
+        self._fetched_at = 0
+        self._last_attempt = 0
+        self._failures = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        '''
+        Download the JWKS document and index its keys by kid
+        '''
+        jsonurl = urlopen(self.url, timeout=self.timeout)
+        jwks = json.loads(jsonurl.read())
+        keys = {}
+        for key in jwks['keys']:
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+        return keys
+
+    def refresh(self, force=False):
+        '''
+        Refetch the keys, unless another thread is already doing it.
+        When there are no keys yet, wait for the running refresh
+        instead of returning empty handed.
+        '''
+        blocking = not self._keys
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            self._refresh(force)
+        finally:
+            self._lock.release()
+
+    def refresh_in_background(self):
+        '''
+        Refetch the keys in a daemon thread while the caller keeps
+        using the stale ones. Returns the thread, or None if another
+        refresh is already running
+        '''
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                self._refresh(False)
+            except AuthError:
+                pass  # the keys are kept, the next request retries
+            finally:
+                self._lock.release()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh(self, force):
+        # called with the lock held
+        now = time.time()
+        if not force and now - self._fetched_at < self.ttl:
+            return  # another thread refreshed while we waited
+        if force and now - self._last_attempt < self.min_refresh_interval:
+            return  # rate limit refreshes triggered by unknown kids
+        if now < self._retry_at:
+            if not self._keys:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+            return  # back off after a failed fetch
+        self._last_attempt = now
+        try:
+            keys = self.fetch()
+        except Exception:
+            self._failures += 1
+            self._retry_at = now + min(
+                self.retry_backoff * 2 ** (self._failures - 1),
+                self.max_retry_backoff)
+            if not self._keys:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+            return  # serve the stale keys until Auth0 is back
+        self._keys = keys
+        self._fetched_at = now
+        self._failures = 0
+        self._retry_at = 0
+
+    def get_key(self, kid):
+        '''
+        Return the rsa key for kid, or None if Auth0 doesn't know it
+        '''
+        now = time.time()
+        if now - self._fetched_at >= self.ttl:
+            if not self._keys:
+                self.refresh()
+            elif now >= self._retry_at:
+                self.refresh_in_background()
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh(force=True)
+            key = self._keys.get(kid)
+        return key
+
+
+jwks_store = JWKSStore(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+
+# Permission Registry
+'''
+PermissionRegistry
+Interns every permission used by requires_auth and gives it a bit, so
+checking a permission is a single AND against the token's mask.
+'''
+
+
+class PermissionRegistry:
+    def __init__(self):
+        self._bits = {}
+        self._lock = threading.Lock()
+
+    def register(self, permission):
+        '''
+        Return the bit of permission, assigning a new one if needed
+        '''
+        with self._lock:
+            if permission not in self._bits:
+                self._bits[permission] = 1 << len(self._bits)
+            return self._bits[permission]
+
+    @property
+    def version(self):
+        # bits are only ever added, so the count identifies the state
+        return len(self._bits)
+
+    def mask(self, permissions):
+        '''
+        Fold a list of permissions into a bit mask,
+        permissions nobody requires are ignored
+        '''
+        mask = 0
+        for permission in permissions:
+            mask |= self._bits.get(permission, 0)
+        return mask
+
+    def scopes(self):
+        return sorted(self._bits)
+
+
+permission_registry = PermissionRegistry()
+
+'''
+VerifiedToken
+Decoded payload of a verified token together with its permissions
+compiled once into a frozenset and a registry bit mask
+'''
+
+
+class VerifiedToken:
+    __slots__ = ('payload', 'permissions', '_mask', '_mask_version')
+
+    def __init__(self, payload):
+        self.payload = payload
+        if 'permissions' in payload:
+            self.permissions = frozenset(payload['permissions'])
+        else:
+            self.permissions = None
+        self._mask = 0
+        self._mask_version = -1
+
+    @property
+    def mask(self):
+        # recompile only if new permissions were registered since
+        if self._mask_version != permission_registry.version:
+            self._mask = permission_registry.mask(self.permissions)
+            self._mask_version = permission_registry.version
+        return self._mask
+
+
+# Verified Token Cache
+'''
+TokenCache
+Bounded LRU of tokens that already passed signature verification.
+Entries are keyed by the sha256 of the token and dropped once the
+token's exp is reached, so a cached token is never accepted after it
+would have failed jwt.decode.
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        '''
+        Return the cached VerifiedToken of token, or None
+        '''
+        key = self.key(token)
+        with self._lock:
+            verified = self._entries.get(key)
+            if verified is not None and \
+                    verified.payload['exp'] <= time.time():
+                del self._entries[key]  # expired since it was cached
+                verified = None
+            if verified is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return verified
+
+    def put(self, token, verified):
+        '''
+        Cache a VerifiedToken.
+        Tokens without exp are never cached.
+        '''
+        if not isinstance(verified.payload.get('exp'), (int, float)):
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = verified
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict_subject(self, sub):
+        '''
+        Drop every cached token issued to sub, returns how many
+        '''
+        with self._lock:
+            keys = [key for key, verified in self._entries.items()
+                    if verified.payload.get('sub') == sub]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+token_cache = TokenCache()
+
+
 # Auth Header
 
 
@@ -70,19 +380,19 @@ def get_token_auth_header():
     return token
 
 
-def check_permissions(permission, payload):
+def check_permissions(required, verified):
     '''
     Check if permissions key in payload
     '''
-    if 'permissions' not in payload:
+    if verified.permissions is None:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
     '''
-    Check if the Permission exist in the permissions list
+    Check if the Permission bit is set in the token's mask
     '''
-    if permission not in payload['permissions']:
+    if not verified.mask & required:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -92,24 +402,16 @@ def check_permissions(permission, payload):
     
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    '''
+    Look up the signing key in the cached JWKS
+    '''
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -153,6 +455,12 @@ def verify_decode_jwt(token):
 
 
 def requires_auth(permission=''):
+    '''
+    the permission is registered when the view is decorated,
+    so the required bit is known before the first request
+    '''
+    required = permission_registry.register(permission)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
@@ -161,14 +469,17 @@ def requires_auth(permission=''):
             '''
             token = get_token_auth_header()
             '''
-            decode and verify jwt
+            decode and verify jwt, unless it was verified before
             '''
-            payload = verify_decode_jwt(token)
+            verified = token_cache.get(token)
+            if verified is None:
+                verified = VerifiedToken(verify_decode_jwt(token))
+                token_cache.put(token, verified)
             '''
             validate claims and check the requested permission
             '''
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            check_permissions(required, verified)
+            return f(verified.payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
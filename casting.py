@@ -0,0 +1,111 @@
+import os
+from sqlalchemy import select, func, and_, literal
+from models import db, Actor, Movie, association_table
+
+'''
+    Casting match, rank the actors that fit a role spec.
+    The candidates are narrowed with the (gender, age) index, their
+    movie_count is kept on the row and only their unreleased movies are
+    joined and aggregated per actor in the same statement, so the
+    ranking happens in the database and only the top candidates are
+    sent back.
+'''
+
+MATCH_DEFAULT_LIMIT = int(os.environ.get('MATCH_DEFAULT_LIMIT', 20))
+MATCH_MAX_LIMIT = int(os.environ.get('MATCH_MAX_LIMIT', 100))
+MATCH_MAX_EXCLUDED = int(os.environ.get('MATCH_MAX_EXCLUDED', 1000))
+
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) \
+        and value >= 0
+
+
+'''
+    validate a role spec, return it with its defaults
+    or None if it's invalid
+    - gender: exact gender (optional)
+    - min_age, max_age: inclusive age range (required)
+    - exclude: ids of actors that can't be cast
+    - max_concurrent: most unreleased movies a candidate can have
+    - limit: number of candidates
+'''
+
+
+def validate_role(body):
+    if not isinstance(body, dict):
+        return None
+
+    role = {
+        'gender': body.get('gender'),
+        'min_age': body.get('min_age'),
+        'max_age': body.get('max_age'),
+        'exclude': body.get('exclude', []),
+        'max_concurrent': body.get('max_concurrent'),
+        'limit': body.get('limit', MATCH_DEFAULT_LIMIT)
+    }
+
+    if role['gender'] is not None and (
+            not isinstance(role['gender'], str) or not role['gender']):
+        return None
+    if not is_count(role['min_age']) or not is_count(role['max_age']) or \
+            role['min_age'] > role['max_age']:
+        return None
+    if not isinstance(role['exclude'], list) or \
+            len(role['exclude']) > MATCH_MAX_EXCLUDED or \
+            not all(is_count(id) for id in role['exclude']):
+        return None
+    if role['max_concurrent'] is not None and \
+            not is_count(role['max_concurrent']):
+        return None
+    if not is_count(role['limit']) or role['limit'] == 0:
+        return None
+    role['limit'] = min(role['limit'], MATCH_MAX_LIMIT)
+
+    return role
+
+
+'''
+    rank the candidates of a role, the actors with the fewest
+    unreleased (concurrent) movies first, then the closest to the
+    middle of the age range, then the most experienced (most movies)
+'''
+
+
+def match_actors(role):
+    actors = Actor.__table__
+    movies = Movie.__table__
+
+    # only the unreleased movies are joined
+    concurrent = func.count(movies.c.id)
+    # twice the distance to the middle, to stay in integers
+    age_distance = func.abs(
+        actors.c.age * 2 - literal(role['min_age'] + role['max_age']))
+
+    filters = [actors.c.age >= role['min_age'],
+               actors.c.age <= role['max_age']]
+    if role['gender'] is not None:
+        filters.append(actors.c.gender == role['gender'])
+    if role['exclude']:
+        filters.append(actors.c.id.notin_(role['exclude']))
+
+    query = select([
+        actors.c.id, actors.c.name, actors.c.age, actors.c.gender,
+        actors.c.movie_count,
+        concurrent.label('concurrent_movies')
+    ]).select_from(
+        actors.outerjoin(
+            association_table,
+            association_table.c.actor_id == actors.c.id).outerjoin(
+            movies, and_(movies.c.id == association_table.c.movie_id,
+                         movies.c.release_date >= func.current_date()))
+    ).where(and_(*filters)).group_by(actors.c.id)
+
+    if role['max_concurrent'] is not None:
+        query = query.having(concurrent <= role['max_concurrent'])
+
+    query = query.order_by(
+        concurrent, age_distance, actors.c.movie_count.desc(), actors.c.id
+    ).limit(role['limit'])
+
+    return [dict(row) for row in db.session.execute(query)]
@@ -0,0 +1,161 @@
+import csv
+import io
+import time
+from itertools import chain
+from sqlalchemy import text
+from models import db
+import serialization
+
+'''
+    Streaming export of the catalog.
+    Rows are read from a server side cursor (stream_results) in batches
+    of batch_size and every batch is written out before the next one
+    is fetched, so memory stays the same whatever the size of the table.
+    Formats:
+        - csv: a header row then one row per line
+        - ndjson: one JSON object per line
+        - columnar: a JSON header line with the columns, then one JSON
+          line per batch holding every column as an array
+'''
+
+DEFAULT_BATCH_SIZE = 10000
+
+TABLES = {
+    'actors': 'SELECT id, name, age, gender FROM actors ORDER BY id',
+    'movies': 'SELECT id, title, release_date FROM movies ORDER BY id',
+    'casting': 'SELECT movie_id, actor_id FROM association '
+               'ORDER BY movie_id, actor_id'
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'columnar': 'application/x-ndjson'
+}
+
+
+# one JSON line, dates are written as ISO 8601
+def dumps(data):
+    return serialization.dumps(data).decode('utf-8') + '\n'
+
+
+'''
+    format batches of rows, yields the chunks of text to write
+'''
+
+
+def format_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def format_ndjson(columns, batches):
+    for batch in batches:
+        yield ''.join(dumps(dict(zip(columns, row))) for row in batch)
+
+
+def format_columnar(columns, batches):
+    yield dumps({'columns': columns})
+    for batch in batches:
+        yield dumps({
+            'rows': len(batch),
+            'data': [list(column) for column in zip(*batch)]
+        })
+
+
+FORMATTERS = {
+    'csv': format_csv,
+    'ndjson': format_ndjson,
+    'columnar': format_columnar
+}
+
+
+'''
+    yield the rows of table in batches of batch_size through a server
+    side cursor, stats (if given) is updated with the rows read
+'''
+
+
+def read_batches(connection, table, batch_size, stats):
+    result = connection.execution_options(stream_results=True).execute(
+        text(TABLES[table]))
+    stats['columns'] = list(result.keys())
+    try:
+        while True:
+            batch = result.fetchmany(batch_size)
+            if not batch:
+                break
+            stats['rows'] += len(batch)
+            yield [tuple(row) for row in batch]
+    finally:
+        result.close()
+
+
+'''
+    export table in format, yields chunks of text. stats receives the
+    number of rows, the elapsed time and the rows per second
+'''
+
+
+def export_table(table, format, batch_size=DEFAULT_BATCH_SIZE, stats=None):
+    if table not in TABLES:
+        raise ValueError(f'unknown table {table}')
+    if format not in FORMATTERS:
+        raise ValueError(f'unknown format {format}')
+    if stats is None:
+        stats = {}
+    stats.update({'rows': 0, 'seconds': 0, 'rows_per_second': 0})
+
+    started = time.time()
+    connection = db.engine.connect()
+    try:
+        batches = read_batches(connection, table, batch_size, stats)
+        # fetch the first batch so the columns are known
+        first = next(batches, None)
+        if first is not None:
+            batches = chain([first], batches)
+
+        for chunk in FORMATTERS[format](stats['columns'], batches):
+            if chunk:
+                yield chunk
+    finally:
+        connection.close()
+        stats['seconds'] = time.time() - started
+        if stats['seconds']:
+            stats['rows_per_second'] = stats['rows'] / stats['seconds']
+
+
+'''
+    export table to the file at path, csv goes through COPY TO STDOUT
+'''
+
+
+def export_to_file(table, format, path, batch_size=DEFAULT_BATCH_SIZE):
+    stats = {}
+    with open(path, 'w', newline='') as out:
+        if format == 'csv':
+            started = time.time()
+            connection = db.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.copy_expert(
+                    f'COPY ({TABLES[table]}) TO STDOUT '
+                    f'WITH (FORMAT csv, HEADER)', out)
+                stats['rows'] = cursor.rowcount
+                connection.commit()
+            finally:
+                connection.close()
+            stats['seconds'] = time.time() - started
+            stats['rows_per_second'] = \
+                stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+        else:
+            for chunk in export_table(table, format, batch_size, stats):
+                out.write(chunk)
+    return stats
@@ -0,0 +1,89 @@
+import os
+from sqlalchemy import select, and_
+from models import db, Actor, Movie, association_table
+from pagination import paginate
+
+'''
+    Scheduling conflicts, an actor has a conflict when two of the
+    actor's movies release within CONFLICT_WINDOW_DAYS of each other.
+    Both checks are one indexed join over the association table.
+'''
+
+CONFLICT_WINDOW_DAYS = int(os.environ.get('CONFLICT_WINDOW_DAYS', 30))
+
+# what /assign does with conflicts when the request doesn't say:
+# off (no check), flag (assign and report them) or reject (409)
+CONFLICT_MODES = ('off', 'flag', 'reject')
+CONFLICT_MODE = os.environ.get('CONFLICT_MODE', 'off')
+
+
+'''
+    the actor's other movies that release within window days of
+    the movie, the actor's movies come from the (actor_id, movie_id)
+    index. The actor row is locked (FOR UPDATE) first and stays locked
+    until the transaction ends, so concurrent assigns of the same actor
+    check and insert one after the other
+'''
+
+
+def find_conflicts(movie_id, actor_id, window=CONFLICT_WINDOW_DAYS):
+    db.session.query(Actor.id).filter(
+        Actor.id == actor_id).with_for_update().first()
+
+    movies = Movie.__table__
+    target = movies.alias('target')
+
+    query = select([
+        movies.c.id, movies.c.title, movies.c.release_date
+    ]).select_from(
+        association_table.join(
+            movies, movies.c.id == association_table.c.movie_id).join(
+            target, target.c.id == movie_id)
+    ).where(and_(
+        association_table.c.actor_id == actor_id,
+        movies.c.id != target.c.id,
+        movies.c.release_date.between(target.c.release_date - window,
+                                      target.c.release_date + window)
+    )).order_by(movies.c.release_date, movies.c.id)
+
+    return [dict(row) for row in db.session.execute(query)]
+
+
+'''
+    one page of the conflicts of the catalog, the association table
+    is joined with itself on the actor and every pair of movies is
+    reported once (movie_id < other_movie_id). The pages are ordered
+    by (actor_id, movie_id, other_movie_id), returns the conflicts and
+    the cursor of the next page
+'''
+
+
+def find_all_conflicts(window=CONFLICT_WINDOW_DAYS):
+    movies = Movie.__table__
+    cast = association_table.alias('cast')
+    other_cast = association_table.alias('other_cast')
+    movie = movies.alias('movie')
+    other_movie = movies.alias('other_movie')
+
+    columns = (cast.c.actor_id,
+               movie.c.id.label('movie_id'),
+               other_movie.c.id.label('other_movie_id'))
+    query = select([
+        columns[0],
+        columns[1],
+        movie.c.release_date,
+        columns[2],
+        other_movie.c.release_date.label('other_release_date')
+    ]).select_from(
+        cast.join(
+            other_cast, and_(other_cast.c.actor_id == cast.c.actor_id,
+                             other_cast.c.movie_id > cast.c.movie_id)).join(
+            movie, movie.c.id == cast.c.movie_id).join(
+            other_movie, other_movie.c.id == other_cast.c.movie_id)
+    ).where(
+        other_movie.c.release_date.between(movie.c.release_date - window,
+                                           movie.c.release_date + window)
+    )
+
+    rows, next_cursor = paginate(query, *columns)
+    return [dict(row) for row in rows], next_cursor
@@ -0,0 +1,361 @@
+import heapq
+import os
+import threading
+import time
+from array import array
+from itertools import accumulate
+from sqlalchemy import select, func
+from models import db, association_table, change_counters
+from models import get_change_counters
+
+'''
+    Co-star graph, who has worked with whom.
+    The association table is kept in memory as two compact adjacency
+    indexes (actor -> movies and movie -> actors), so the co-stars and
+    the shortest path between two actors never scan the database.
+    An edge costs 8 bytes (one int32 on each side), tens of millions
+    of edges fit in a few hundred MB.
+'''
+
+# How long (seconds) the graph is served before it's rebuilt, if the
+# association table was changed by another worker or process
+COSTAR_GRAPH_TTL = int(os.environ.get('COSTAR_GRAPH_TTL', 300))
+# Number of assigns/unassigns kept on top of the indexes before the
+# graph is rebuilt
+COSTAR_OVERLAY_LIMIT = int(os.environ.get('COSTAR_OVERLAY_LIMIT', 100000))
+# Longest path (in movies) searched between two actors
+COSTAR_MAX_DEPTH = int(os.environ.get('COSTAR_MAX_DEPTH', 6))
+# Association rows read from the database at a time while building
+COSTAR_BATCH_SIZE = int(os.environ.get('COSTAR_BATCH_SIZE', 10000))
+
+EMPTY = array('i')
+
+
+'''
+AdjacencyIndex
+Compressed sparse rows, the neighbours of node n are
+targets[offsets[n]:offsets[n + 1]], sorted. Node ids are the row ids,
+offsets has one entry per id up to the largest one.
+'''
+
+
+class AdjacencyIndex:
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_sorted(cls, edges, max_id):
+        '''
+        Build the index from (node, target) pairs sorted by node
+        then target, e.g. a cursor over the association table
+        '''
+        degrees = array('q', bytes(8 * (max_id + 1)))
+        targets = array('i')
+        for node, target in edges:
+            degrees[node] += 1
+            targets.append(target)
+        offsets = array('q', [0])
+        offsets.extend(accumulate(degrees))
+        return cls(offsets, targets)
+
+    def neighbors(self, node):
+        if node < 0 or node + 1 >= len(self.offsets):
+            return EMPTY
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def has_edge(self, node, target):
+        return target in self.neighbors(node)
+
+    def nbytes(self):
+        return self.offsets.itemsize * len(self.offsets) + \
+            self.targets.itemsize * len(self.targets)
+
+
+'''
+CoStarGraph
+The actor -> movies and movie -> actors indexes, with the assigns and
+unassigns made since they were built kept on top of them (overlay).
+'''
+
+
+class CoStarGraph:
+    def __init__(self, movies_of_actor, actors_of_movie):
+        self.movies_of_actor = movies_of_actor
+        self.actors_of_movie = actors_of_movie
+        # (movie_id, actor_id) pairs added to or removed from the indexes
+        self.added = set()
+        self.removed = set()
+        self.added_movies = {}
+        self.added_actors = {}
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        '''
+        Build the graph from (movie_id, actor_id) pairs in memory
+        '''
+        pairs = set(pairs)
+        max_actor = max((actor for movie, actor in pairs), default=0)
+        max_movie = max((movie for movie, actor in pairs), default=0)
+        return cls(
+            AdjacencyIndex.from_sorted(
+                sorted((actor, movie) for movie, actor in pairs), max_actor),
+            AdjacencyIndex.from_sorted(sorted(pairs), max_movie))
+
+    @classmethod
+    def from_connection(cls, connection, batch_size=COSTAR_BATCH_SIZE):
+        '''
+        Build the graph from the association table, the rows are read
+        in index order from a server side cursor in batches
+        '''
+        movie_id = association_table.c.movie_id
+        actor_id = association_table.c.actor_id
+
+        def edges(node, target):
+            result = connection.execution_options(
+                stream_results=True).execute(
+                select([node, target]).order_by(node, target))
+            while True:
+                batch = result.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield from batch
+
+        max_movie, max_actor = connection.execute(select([
+            func.coalesce(func.max(movie_id), 0),
+            func.coalesce(func.max(actor_id), 0)])).first()
+        return cls(
+            AdjacencyIndex.from_sorted(edges(actor_id, movie_id), max_actor),
+            AdjacencyIndex.from_sorted(edges(movie_id, actor_id), max_movie))
+
+    def overlay_size(self):
+        return len(self.added) + len(self.removed)
+
+    def add(self, movie_id, actor_id):
+        pair = (movie_id, actor_id)
+        if pair in self.removed:
+            self.removed.discard(pair)
+        elif pair not in self.added and \
+                not self.movies_of_actor.has_edge(actor_id, movie_id):
+            self.added.add(pair)
+            self.added_movies.setdefault(actor_id, set()).add(movie_id)
+            self.added_actors.setdefault(movie_id, set()).add(actor_id)
+
+    def remove(self, movie_id, actor_id):
+        pair = (movie_id, actor_id)
+        if pair in self.added:
+            self.added.discard(pair)
+            self.added_movies[actor_id].discard(movie_id)
+            self.added_actors[movie_id].discard(actor_id)
+        elif self.movies_of_actor.has_edge(actor_id, movie_id):
+            self.removed.add(pair)
+
+    def movies_of(self, actor_id):
+        movies = self.movies_of_actor.neighbors(actor_id)
+        if not self.added and not self.removed:
+            return movies
+        if self.removed:
+            movies = [movie for movie in movies
+                      if (movie, actor_id) not in self.removed]
+        return list(movies) + list(self.added_movies.get(actor_id, ()))
+
+    def actors_of(self, movie_id):
+        actors = self.actors_of_movie.neighbors(movie_id)
+        if not self.added and not self.removed:
+            return actors
+        if self.removed:
+            actors = [actor for actor in actors
+                      if (movie_id, actor) not in self.removed]
+        return list(actors) + list(self.added_actors.get(movie_id, ()))
+
+    def co_stars(self, actor_id, limit):
+        '''
+        The actors who shared a movie with actor_id, the most shared
+        movies first, as (actor_id, shared_movies) pairs
+        '''
+        shared = {}
+        for movie in self.movies_of(actor_id):
+            for actor in self.actors_of(movie):
+                if actor != actor_id:
+                    shared[actor] = shared.get(actor, 0) + 1
+        return heapq.nsmallest(
+            limit, shared.items(), key=lambda item: (-item[1], item[0]))
+
+    def path(self, source, target, max_depth=COSTAR_MAX_DEPTH):
+        '''
+        Shortest path from source to target with a bidirectional
+        breadth first search, the smaller frontier is expanded first.
+        Returns the actor ids and the movie ids linking them
+        (movies[i] links actors[i] and actors[i + 1]), or None if they
+        are more than max_depth movies apart
+        '''
+        if source == target:
+            return [source], []
+
+        # actor -> (previous actor, movie) towards each end
+        parents = ({source: None}, {target: None})
+        frontiers = ([source], [target])
+
+        for depth in range(max_depth):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, other = parents[side], parents[1 - side]
+            next_frontier = []
+            meeting = None
+            for actor in frontiers[side]:
+                for movie in self.movies_of(actor):
+                    for co_star in self.actors_of(movie):
+                        if co_star in seen:
+                            continue
+                        seen[co_star] = (actor, movie)
+                        if co_star in other:
+                            meeting = co_star
+                            break
+                        next_frontier.append(co_star)
+                    if meeting is not None:
+                        break
+                if meeting is not None:
+                    break
+
+            if meeting is not None:
+                return self.join_path(parents, meeting)
+            if not next_frontier:
+                return None
+            frontiers = (next_frontier, frontiers[1]) if side == 0 \
+                else (frontiers[0], next_frontier)
+
+        return None
+
+    def join_path(self, parents, meeting):
+        actors, movies = [meeting], []
+        actor = meeting
+        while parents[0][actor] is not None:
+            actor, movie = parents[0][actor]
+            actors.insert(0, actor)
+            movies.insert(0, movie)
+        actor = meeting
+        while parents[1][actor] is not None:
+            actor, movie = parents[1][actor]
+            actors.append(actor)
+            movies.append(movie)
+        return actors, movies
+
+
+'''
+CoStarStore
+Keeps the graph of the worker in memory.
+    - the graph is built from the database on first use
+    - the assigns and unassigns of the worker are applied to it as
+      they commit
+    - it's rebuilt once it's older than ttl if the association table
+      changed (e.g. by another worker or the CSV import), or when the
+      overlay grows past overlay_limit
+    - only one thread rebuilds at a time, the others keep using the
+      current graph, the changes made during the rebuild are replayed
+      on the new one
+'''
+
+
+class CoStarStore:
+    def __init__(self, ttl=COSTAR_GRAPH_TTL,
+                 overlay_limit=COSTAR_OVERLAY_LIMIT):
+        self.ttl = ttl
+        self.overlay_limit = overlay_limit
+        self._graph = None
+        self._built_at = 0
+        self._counter = None
+        self._journal = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        '''
+        Read the association table and its change counter in one
+        snapshot
+        '''
+        with db.engine.connect() as connection:
+            connection = connection.execution_options(
+                isolation_level='REPEATABLE READ')
+            with connection.begin():
+                # the counter is the sum of its shards
+                counter = connection.execute(select([
+                    func.sum(change_counters.c.counter)]).where(
+                    change_counters.c.table_name == 'association')).scalar()
+                return CoStarGraph.from_connection(connection), \
+                    int(counter or 0)
+
+    def is_stale(self):
+        if self._graph is None:
+            return True
+        if self._graph.overlay_size() > self.overlay_limit:
+            return True
+        if time.time() - self._built_at < self.ttl:
+            return False
+        counter, = get_change_counters('association')
+        if counter == self._counter:
+            self._built_at = time.time()  # nothing changed, check later
+            return False
+        return True
+
+    def refresh(self):
+        '''
+        Rebuild the graph, unless another thread is already doing it.
+        When there is no graph yet, wait for the running rebuild.
+        '''
+        blocking = self._graph is None
+        if not self._build_lock.acquire(blocking=blocking):
+            return
+        try:
+            if self._graph is not None and not self.is_stale():
+                return  # another thread rebuilt while we waited
+            with self._lock:
+                self._journal = []
+            try:
+                graph, counter = self.build()
+            finally:
+                with self._lock:
+                    journal, self._journal = self._journal, None
+            with self._lock:
+                for change, movie_id, actor_id in journal:
+                    change(graph, movie_id, actor_id)
+                self._graph = graph
+                self._counter = counter
+                self._built_at = time.time()
+        finally:
+            self._build_lock.release()
+
+    def graph(self):
+        if self.is_stale():
+            self.refresh()
+        return self._graph
+
+    def apply(self, change, pairs):
+        with self._lock:
+            for movie_id, actor_id in pairs:
+                if self._graph is not None:
+                    change(self._graph, movie_id, actor_id)
+                if self._journal is not None:
+                    self._journal.append((change, movie_id, actor_id))
+
+    def assigned(self, pairs):
+        '''
+        Apply committed (movie_id, actor_id) assigns
+        '''
+        self.apply(CoStarGraph.add, pairs)
+
+    def unassigned(self, pairs):
+        '''
+        Apply committed (movie_id, actor_id) unassigns
+        '''
+        self.apply(CoStarGraph.remove, pairs)
+
+    def invalidate(self):
+        '''
+        Forget the graph, the next query rebuilds it
+        '''
+        with self._lock:
+            self._graph = None
+
+
+costar_store = CoStarStore()
@@ -0,0 +1,205 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from models import db
+
+'''
+    Bulk CSV import through Postgres COPY.
+    The CSV is read in chunks of chunk_size rows, every chunk is copied
+    into a temporary staging table with COPY FROM STDIN and merged into
+    the real table with one set based INSERT ... SELECT, in its own
+    transaction. After each chunk the number of imported rows is saved
+    in a checkpoint file next to the CSV, so an interrupted import
+    continues where it stopped.
+'''
+
+DEFAULT_CHUNK_SIZE = 50000
+
+'''
+    For every kind of CSV: the columns it must have, the staging table
+    and the statement merging the staging table into the real table
+'''
+KINDS = {
+    'actors': {
+        'columns': ['id', 'name', 'age', 'gender'],
+        'staging': 'CREATE TEMPORARY TABLE staging_actors ('
+                   'id integer, name varchar(250), age integer, '
+                   'gender varchar) ON COMMIT DROP',
+        'merge': 'INSERT INTO actors (id, name, age, gender) '
+                 'SELECT DISTINCT ON (id) id, name, age, gender '
+                 'FROM staging_actors ORDER BY id '
+                 'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, '
+                 'age = EXCLUDED.age, gender = EXCLUDED.gender',
+        'sequence': 'actors'
+    },
+    'movies': {
+        'columns': ['id', 'title', 'release_date'],
+        'staging': 'CREATE TEMPORARY TABLE staging_movies ('
+                   'id integer, title varchar(250), release_date date) '
+                   'ON COMMIT DROP',
+        'merge': 'INSERT INTO movies (id, title, release_date) '
+                 'SELECT DISTINCT ON (id) id, title, release_date '
+                 'FROM staging_movies ORDER BY id '
+                 'ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, '
+                 'release_date = EXCLUDED.release_date',
+        'sequence': 'movies'
+    },
+    'casting': {
+        'columns': ['movie_id', 'actor_id'],
+        'staging': 'CREATE TEMPORARY TABLE staging_casting ('
+                   'movie_id integer, actor_id integer) ON COMMIT DROP',
+        # pairs pointing to a missing movie or actor are skipped
+        'merge': 'INSERT INTO association (movie_id, actor_id) '
+                 'SELECT DISTINCT s.movie_id, s.actor_id '
+                 'FROM staging_casting s '
+                 'JOIN movies m ON m.id = s.movie_id '
+                 'JOIN actors a ON a.id = s.actor_id '
+                 'ON CONFLICT DO NOTHING',
+        'sequence': None
+    }
+}
+
+
+'''
+    checkpoints remember how many rows of which file were imported
+'''
+
+
+def checkpoint_path(path):
+    return path + '.checkpoint'
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_checkpoint(path):
+    try:
+        with open(checkpoint_path(path)) as checkpoint:
+            data = json.load(checkpoint)
+    except (OSError, ValueError):
+        return 0
+    # a checkpoint of another version of the file is useless
+    if data.get('file') != file_signature(path):
+        return 0
+    return data.get('rows', 0)
+
+
+def save_checkpoint(path, rows):
+    temporary = checkpoint_path(path) + '.tmp'
+    with open(temporary, 'w') as checkpoint:
+        json.dump({'file': file_signature(path), 'rows': rows}, checkpoint)
+    os.replace(temporary, checkpoint_path(path))
+
+
+'''
+    read the CSV in lists of at most chunk_size rows,
+    with the columns in the order of the kind
+'''
+
+
+def read_chunks(reader, columns, chunk_size):
+    chunk = []
+    for record in reader:
+        chunk.append([record.get(column) for column in columns])
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+'''
+    copy one chunk into the staging table and merge it,
+    everything in one transaction
+'''
+
+
+def import_chunk(connection, kind, chunk):
+    spec = KINDS[kind]
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(spec['staging'])
+        cursor.copy_expert(
+            'COPY staging_{} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                kind, ', '.join(spec['columns'])),
+            buffer)
+        cursor.execute(spec['merge'])
+        merged = cursor.rowcount
+
+        if spec['sequence'] is not None:
+            # explicit ids don't move the serial sequence
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "coalesce((SELECT max(id) FROM {0}), 1))".format(
+                    spec['sequence']))
+
+        connection.commit()
+        return merged
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+'''
+    import the CSV at path, kind is one of actors, movies or casting
+'''
+
+
+def import_csv(kind, path, chunk_size=DEFAULT_CHUNK_SIZE, restart=False,
+               out=sys.stdout):
+    if kind not in KINDS:
+        raise ValueError(f'unknown kind {kind}, expected one of '
+                         f'{", ".join(KINDS)}')
+    columns = KINDS[kind]['columns']
+
+    skip = 0 if restart else load_checkpoint(path)
+    done = skip
+    merged = 0
+    started = time.time()
+
+    connection = db.engine.raw_connection()
+    try:
+        with open(path, newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            missing = set(columns) - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(
+                    f'{path} is missing the columns {", ".join(missing)}')
+
+            # skip the rows imported before the last checkpoint
+            for _ in zip(range(skip), reader):
+                pass
+            if skip:
+                out.write(f'resuming after {skip} rows\n')
+
+            for chunk in read_chunks(reader, columns, chunk_size):
+                merged += import_chunk(connection, kind, chunk)
+                done += len(chunk)
+                save_checkpoint(path, done)
+
+                elapsed = time.time() - started
+                rate = (done - skip) / elapsed if elapsed else 0
+                out.write(f'{kind}: {done} rows read, {merged} merged '
+                          f'({rate:.0f} rows/s)\n')
+                out.flush()
+    finally:
+        connection.close()
+
+    # the import is complete, a new run starts from the beginning
+    try:
+        os.remove(checkpoint_path(path))
+    except OSError:
+        pass
+
+    return done, merged
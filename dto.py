@@ -0,0 +1,133 @@
+from sqlalchemy import select, and_
+from models import db, Actor, Movie, association_table
+from pagination import paginate
+
+'''
+    Read-only path of the list endpoints.
+    Only the columns of the responses are selected with Core select(),
+    the rows are mapped into __slots__ objects (no ORM instances, no
+    identity map, no change tracking) with the same format() as the
+    models, and the other side of every row of a page is loaded with
+    one more select.
+'''
+
+
+class MovieRow:
+    __slots__ = ('id', 'title', 'release_date', 'version', 'actor_count',
+                 'actors')
+
+    def __init__(self, id, title, release_date, version, actor_count):
+        self.id = id
+        self.title = title
+        self.release_date = release_date
+        self.version = version
+        self.actor_count = actor_count
+        self.actors = []
+
+    # Same as Movie.get_actors()
+    def get_actors(self):
+        return {
+            'actors': [actor.format() for actor in self.actors]
+        }
+
+    # Same as Movie.format()
+    def format(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'release_date': self.release_date,
+            'version': self.version,
+            'actor_count': self.actor_count,
+        }
+
+
+class ActorRow:
+    __slots__ = ('id', 'name', 'age', 'gender', 'version', 'movie_count',
+                 'movies')
+
+    def __init__(self, id, name, age, gender, version, movie_count):
+        self.id = id
+        self.name = name
+        self.age = age
+        self.gender = gender
+        self.version = version
+        self.movie_count = movie_count
+        self.movies = []
+
+    # Same as Actor.get_movies()
+    def get_movies(self):
+        return {
+            'movies': [movie.format() for movie in self.movies]
+        }
+
+    # Same as Actor.format()
+    def format(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'age': self.age,
+            'gender': self.gender,
+            'version': self.version,
+            'movie_count': self.movie_count,
+        }
+
+
+MOVIE_COLUMNS = [getattr(Movie.__table__.c, name)
+                 for name in MovieRow.__slots__[:-1]]
+ACTOR_COLUMNS = [getattr(Actor.__table__.c, name)
+                 for name in ActorRow.__slots__[:-1]]
+
+
+'''
+    attach the related rows of a page, one select of the association
+    joined with the other side for all the ids of the page, match and
+    link are the association columns of the page and of the other side
+'''
+
+
+def load_related(rows, match, link, columns, row_type, attribute):
+    by_id = {row.id: row for row in rows}
+    if not by_id:
+        return
+
+    other_id = columns[0]
+    result = db.session.execute(select([match] + columns).select_from(
+        association_table.join(other_id.table, other_id == link)
+    ).where(match.in_(list(by_id))).order_by(match, other_id))
+
+    for row in result:
+        getattr(by_id[row[0]], attribute).append(row_type(*row[1:]))
+
+
+'''
+    one page of actors with their movies, filters and the sort columns
+    as for the ORM query, returns the actors and the next cursor
+'''
+
+
+def actor_page(filters, columns, descending=False):
+    statement = select(ACTOR_COLUMNS).where(and_(*filters))
+    rows, next_cursor = paginate(statement, *columns, descending=descending)
+
+    actors = [ActorRow(*row) for row in rows]
+    load_related(actors, association_table.c.actor_id,
+                 association_table.c.movie_id, MOVIE_COLUMNS,
+                 MovieRow, 'movies')
+    return actors, next_cursor
+
+
+'''
+    one page of movies with their actors, filters and the sort columns
+    as for the ORM query, returns the movies and the next cursor
+'''
+
+
+def movie_page(filters, columns, descending=False):
+    statement = select(MOVIE_COLUMNS).where(and_(*filters))
+    rows, next_cursor = paginate(statement, *columns, descending=descending)
+
+    movies = [MovieRow(*row) for row in rows]
+    load_related(movies, association_table.c.movie_id,
+                 association_table.c.actor_id, ACTOR_COLUMNS,
+                 ActorRow, 'actors')
+    return movies, next_cursor
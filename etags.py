@@ -0,0 +1,87 @@
+from functools import wraps
+from flask import g, request, Response, abort
+from models import Actor, Movie, get_change_counters, get_row_version
+
+'''
+    Conditional GET support.
+    Detail responses get a strong ETag made of the row version and the
+    change counters of the tables embedded in them, list responses get
+    a weak ETag made of the change counters of the whole catalog.
+    Both are read with a single small query, so a matching
+    If-None-Match is answered with 304 before the view loads anything.
+    The ETag is kept in g.etag for the response cache key.
+'''
+
+
+def actor_etag(id):
+    version, counters = get_row_version(Actor, id, 'movies', 'association')
+    if version is None:
+        return None  # let the view answer 404
+    return '-'.join(str(part) for part in ['actor', id, version] + counters)
+
+
+def movie_etag(id):
+    version, counters = get_row_version(Movie, id, 'actors', 'association')
+    if version is None:
+        return None  # let the view answer 404
+    return '-'.join(str(part) for part in ['movie', id, version] + counters)
+
+
+def catalog_etag():
+    counters = get_change_counters('actors', 'movies', 'association')
+    return '-'.join(str(part) for part in ['catalog'] + counters)
+
+
+'''
+    decorator for views that come after requires_auth,
+    etag(**kwargs) returns the ETag of the resource or None
+'''
+
+
+def conditional(etag, weak=False):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(token, *args, **kwargs):
+            value = g.etag = etag(**kwargs)
+            if value is None:
+                return f(token, *args, **kwargs)
+
+            if request.if_none_match.contains_weak(value):
+                response = Response(status=304)
+                response.set_etag(value, weak=weak)
+                return response
+
+            response = f(token, *args, **kwargs)
+            if isinstance(response, Response) and \
+                    response.status_code == 200 and \
+                    not response.is_streamed:
+                response.set_etag(value, weak=weak)
+            return response
+
+        return wrapper
+    return conditional_decorator
+
+
+'''
+    read the row version from If-Match, the header may hold the ETag of
+    the detail endpoint or a bare version number. Returns None when
+    there is no If-Match (or it is *), aborts with 400 if it's invalid
+'''
+
+
+def expected_version(kind, id):
+    if not request.if_match or request.if_match.star_tag:
+        return None
+
+    value = request.if_match.as_set()
+    if len(value) != 1:
+        abort(400)  # bad request
+    value = value.pop()
+
+    parts = value.split('-')
+    if len(parts) == 1 and parts[0].isdigit():
+        return int(parts[0])
+    if len(parts) >= 3 and parts[0] == kind and parts[1] == str(id) and \
+            parts[2].isdigit():
+        return int(parts[2])
+    abort(400)  # bad request
@@ -0,0 +1,167 @@
+from datetime import date
+from flask import request, abort
+from models import Actor, Movie
+
+'''
+    Query string filters for the list endpoints.
+    Every filter compiles to a SQL predicate, so the database does the
+    search with its indexes and only the matching page is sent back.
+'''
+
+
+'''
+    read an optional non negative integer from the query string,
+    abort with 400 if it's not one
+'''
+
+
+def get_int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400)  # bad request
+    if value < 0:
+        abort(400)  # bad request
+    return value
+
+
+'''
+    read an optional ISO date from the query string,
+    abort with 400 if it's not one
+'''
+
+
+def get_date_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400)  # bad request
+
+
+'''
+    read an optional non empty string from the query string,
+    abort with 400 if it's empty
+'''
+
+
+def get_str_arg(name):
+    value = request.args.get(name)
+    if value is not None and not value:
+        abort(400)  # bad request
+    return value
+
+
+'''
+    escape the LIKE wildcards of a user string
+'''
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+'''
+    filters of GET /actors
+    - name: case insensitive substring of the name (trigram index)
+    - gender: exact gender
+    - min_age, max_age: inclusive age range ((gender, age) index)
+'''
+
+
+def actor_filters():
+    filters = []
+
+    name = get_str_arg('name')
+    if name is not None:
+        filters.append(Actor.name.ilike(
+            '%' + escape_like(name) + '%', escape='\\'))
+
+    gender = get_str_arg('gender')
+    if gender is not None:
+        filters.append(Actor.gender == gender)
+
+    min_age = get_int_arg('min_age')
+    if min_age is not None:
+        filters.append(Actor.age >= min_age)
+
+    max_age = get_int_arg('max_age')
+    if max_age is not None:
+        filters.append(Actor.age <= max_age)
+
+    return filters
+
+
+'''
+    filters of GET /movies
+    - released_after, released_before: inclusive release date range
+    - title: prefix of the title (text_pattern_ops index)
+    - search: case insensitive substring of the title (trigram index)
+'''
+
+
+def movie_filters():
+    filters = []
+
+    released_after = get_date_arg('released_after')
+    if released_after is not None:
+        filters.append(Movie.release_date >= released_after)
+
+    released_before = get_date_arg('released_before')
+    if released_before is not None:
+        filters.append(Movie.release_date <= released_before)
+
+    title = get_str_arg('title')
+    if title is not None:
+        filters.append(Movie.title.like(
+            escape_like(title) + '%', escape='\\'))
+
+    search = get_str_arg('search')
+    if search is not None:
+        filters.append(Movie.title.ilike(
+            '%' + escape_like(search) + '%', escape='\\'))
+
+    return filters
+
+
+# sort orders of GET /actors and GET /movies,
+# the id breaks the ties of the pages
+ACTOR_SORTS = {
+    'movie_count': ((Actor.movie_count, Actor.id), False),
+    '-movie_count': ((Actor.movie_count, Actor.id), True)
+}
+
+MOVIE_SORTS = {
+    'release_date': ((Movie.release_date, Movie.id), False),
+    '-release_date': ((Movie.release_date, Movie.id), True),
+    'title': ((Movie.title, Movie.id), False),
+    'actor_count': ((Movie.actor_count, Movie.id), False),
+    '-actor_count': ((Movie.actor_count, Movie.id), True)
+}
+
+'''
+    the key columns and direction of the sort of the query string,
+    by id when there is no sort, abort with 400 if it's unknown
+'''
+
+
+def get_sort(sorts, id):
+    sort = request.args.get('sort')
+    if sort is None:
+        return (id,), False
+    if sort not in sorts:
+        abort(400)  # bad request
+    return sorts[sort]
+
+
+def actor_sort():
+    return get_sort(ACTOR_SORTS, Actor.id)
+
+
+def movie_sort():
+    return get_sort(MOVIE_SORTS, Movie.id)
@@ -1,8 +1,12 @@
-from flask_script import Manager
+from flask_script import Manager, Command
 from flask_migrate import Migrate, MigrateCommand
 
 from app import APP
 from models import db
+import models
+import csv_import
+import catalog_export
+import read_benchmark
 
 migrate = Migrate(APP, db)
 manager = Manager(APP)
@@ -10,5 +14,83 @@ manager = Manager(APP)
 manager.add_command('db', MigrateCommand)
 
 
+'''
+    Import a large actors, movies or casting CSV with COPY,
+    e.g. python manage.py import_csv -k actors -f actors.csv
+'''
+
+
+@manager.option('-k', '--kind', dest='kind', required=True,
+                choices=list(csv_import.KINDS), help='what the CSV contains')
+@manager.option('-f', '--file', dest='path', required=True,
+                help='path of the CSV file')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=csv_import.DEFAULT_CHUNK_SIZE,
+                help='rows copied and merged per transaction')
+@manager.option('--restart', dest='restart', action='store_true',
+                help='ignore the checkpoint and start from the first row')
+def import_csv(kind, path, chunk_size, restart):
+    rows, merged = csv_import.import_csv(kind, path, chunk_size, restart)
+    print(f'imported {path}: {rows} rows, {merged} merged')
+
+
+'''
+    Export a table of the catalog to a file,
+    e.g. python manage.py export -t movies -f ndjson -o movies.ndjson
+'''
+
+
+@manager.option('-t', '--table', dest='table', required=True,
+                choices=list(catalog_export.TABLES), help='what to export')
+@manager.option('-f', '--format', dest='format', default='csv',
+                choices=list(catalog_export.FORMATS), help='output format')
+@manager.option('-o', '--output', dest='path', required=True,
+                help='path of the output file')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=catalog_export.DEFAULT_BATCH_SIZE,
+                help='rows fetched from the database at a time')
+def export(table, format, path, batch_size):
+    stats = catalog_export.export_to_file(table, format, path, batch_size)
+    print(f'exported {table} to {path}: {stats["rows"]} rows in '
+          f'{stats["seconds"]:.1f}s ({stats["rows_per_second"]:.0f} rows/s)')
+
+
+'''
+    Recompute the movie_count of every actor and the actor_count of
+    every movie from the association table, the fixed rows get a new
+    version so the cached responses holding the old counts aren't used,
+    e.g. python manage.py reconcile_counts
+'''
+
+
+class ReconcileCounts(Command):
+    def run(self):
+        actors, movies = models.reconcile_counts()
+        print(f'reconciled counts: {actors} actors, {movies} movies fixed')
+
+
+manager.add_command('reconcile_counts', ReconcileCounts())
+
+
+'''
+    Compare the ORM and the Core (dto.py) read path of the list
+    endpoints, e.g. python manage.py benchmark_reads -k actors -n 200
+'''
+
+
+@manager.option('-k', '--kind', dest='kind', default='actors',
+                choices=list(read_benchmark.KINDS), help='what to read')
+@manager.option('-n', '--rows', dest='rows', type=int,
+                default=read_benchmark.MAX_PAGE_SIZE,
+                help='rows per page, at most MAX_PAGE_SIZE')
+@manager.option('-r', '--repeats', dest='repeats', type=int, default=10,
+                help='pages read per path, the fastest is reported')
+def benchmark_reads(kind, rows, repeats):
+    results = read_benchmark.run(kind, rows, repeats)
+    for path, stats in results.items():
+        print(f'{path}: {stats["ms_per_page"]:.1f} ms per page of {rows} '
+              f'{kind}, {stats["peak_kb"]:.0f} KB allocated')
+
+
 if __name__ == '__main__':
     manager.run()
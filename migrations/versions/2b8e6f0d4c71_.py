@@ -0,0 +1,72 @@
+"""row versions and table change counters for ETags
+
+Revision ID: 2b8e6f0d4c71
+Revises: 7d2f4b1c9a3e
+Create Date: 2026-10-18 13:40:07.518904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e6f0d4c71'
+down_revision = '7d2f4b1c9a3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actors', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    op.add_column('movies', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    op.create_table('change_counters',
+                    sa.Column('table_name', sa.String(length=64),
+                              nullable=False),
+                    sa.Column('counter', sa.BigInteger(),
+                              server_default='0', nullable=False),
+                    sa.PrimaryKeyConstraint('table_name')
+                    )
+
+    op.execute('''
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+''')
+    op.execute('''
+CREATE OR REPLACE FUNCTION bump_change_counter() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_counters (table_name, counter)
+    VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name)
+    DO UPDATE SET counter = change_counters.counter + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''')
+    for table in ('actors', 'movies'):
+        op.execute(f'CREATE TRIGGER {table}_version '
+                   f'BEFORE UPDATE ON {table} FOR EACH ROW '
+                   f'EXECUTE PROCEDURE bump_row_version()')
+    for table in ('actors', 'movies', 'association'):
+        op.execute(f'CREATE TRIGGER {table}_changes '
+                   f'AFTER INSERT OR UPDATE OR DELETE ON {table} '
+                   f'FOR EACH STATEMENT '
+                   f'EXECUTE PROCEDURE bump_change_counter()')
+
+
+def downgrade():
+    for table in ('actors', 'movies', 'association'):
+        op.execute(f'DROP TRIGGER {table}_changes ON {table}')
+    for table in ('actors', 'movies'):
+        op.execute(f'DROP TRIGGER {table}_version ON {table}')
+    op.execute('DROP FUNCTION bump_change_counter()')
+    op.execute('DROP FUNCTION bump_row_version()')
+
+    op.drop_table('change_counters')
+    op.drop_column('movies', 'version')
+    op.drop_column('actors', 'version')
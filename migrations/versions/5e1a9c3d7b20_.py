@@ -0,0 +1,30 @@
+"""indexes for the actor filters
+
+Revision ID: 5e1a9c3d7b20
+Revises: 2b8e6f0d4c71
+Create Date: 2026-10-18 15:02:44.106235
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1a9c3d7b20'
+down_revision = '2b8e6f0d4c71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age'],
+                    unique=False)
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'], unique=False,
+                    postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
@@ -0,0 +1,106 @@
+"""movie_count and actor_count kept by a trigger on association
+
+Revision ID: 6a3d8b5f0e94
+Revises: 9c4f2e8a1d63
+Create Date: 2026-10-18 16:38:25.772014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3d8b5f0e94'
+down_revision = '9c4f2e8a1d63'
+branch_labels = None
+depends_on = None
+
+COUNTERS = (('actors', 'movie_count', 'actor_id'),
+            ('movies', 'actor_count', 'movie_id'))
+
+
+def upgrade():
+    op.add_column('actors', sa.Column('movie_count', sa.Integer(),
+                                      server_default='0', nullable=False))
+    op.add_column('movies', sa.Column('actor_count', sa.Integer(),
+                                      server_default='0', nullable=False))
+
+    # a counter update alone doesn't increase the row version
+    for table, counter, match in COUNTERS:
+        op.execute(f'DROP TRIGGER {table}_version ON {table}')
+        op.execute(f'CREATE TRIGGER {table}_version '
+                   f'BEFORE UPDATE ON {table} FOR EACH ROW '
+                   f'WHEN (OLD.{counter} IS NOT DISTINCT FROM '
+                   f'NEW.{counter}) '
+                   f'EXECUTE PROCEDURE bump_row_version()')
+
+    for table, counter, match in COUNTERS:
+        op.execute(f'''
+UPDATE {table} SET {counter} = counts.count
+FROM (SELECT {match}, count(*) AS count FROM association
+      GROUP BY {match}) AS counts
+WHERE {table}.id = counts.{match}
+''')
+
+    op.execute('''
+CREATE OR REPLACE FUNCTION count_cast() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE movies SET actor_count = movies.actor_count - changed.count
+        FROM (SELECT movie_id, count(*) AS count FROM old_rows
+              GROUP BY movie_id) AS changed
+        WHERE movies.id = changed.movie_id;
+        UPDATE actors SET movie_count = actors.movie_count - changed.count
+        FROM (SELECT actor_id, count(*) AS count FROM old_rows
+              GROUP BY actor_id) AS changed
+        WHERE actors.id = changed.actor_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE movies SET actor_count = movies.actor_count + changed.count
+        FROM (SELECT movie_id, count(*) AS count FROM new_rows
+              GROUP BY movie_id) AS changed
+        WHERE movies.id = changed.movie_id;
+        UPDATE actors SET movie_count = actors.movie_count + changed.count
+        FROM (SELECT actor_id, count(*) AS count FROM new_rows
+              GROUP BY actor_id) AS changed
+        WHERE actors.id = changed.actor_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''')
+    op.execute('CREATE TRIGGER association_count_insert '
+               'AFTER INSERT ON association '
+               'REFERENCING NEW TABLE AS new_rows '
+               'FOR EACH STATEMENT EXECUTE PROCEDURE count_cast()')
+    op.execute('CREATE TRIGGER association_count_update '
+               'AFTER UPDATE ON association '
+               'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+               'FOR EACH STATEMENT EXECUTE PROCEDURE count_cast()')
+    op.execute('CREATE TRIGGER association_count_delete '
+               'AFTER DELETE ON association '
+               'REFERENCING OLD TABLE AS old_rows '
+               'FOR EACH STATEMENT EXECUTE PROCEDURE count_cast()')
+
+    op.create_index('ix_actors_movie_count_id', 'actors',
+                    ['movie_count', 'id'], unique=False)
+    op.create_index('ix_movies_actor_count_id', 'movies',
+                    ['actor_count', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movies_actor_count_id', table_name='movies')
+    op.drop_index('ix_actors_movie_count_id', table_name='actors')
+
+    for event in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER association_count_{event} ON association')
+    op.execute('DROP FUNCTION count_cast()')
+
+    for table, counter, match in COUNTERS:
+        op.execute(f'DROP TRIGGER {table}_version ON {table}')
+        op.execute(f'CREATE TRIGGER {table}_version '
+                   f'BEFORE UPDATE ON {table} FOR EACH ROW '
+                   f'EXECUTE PROCEDURE bump_row_version()')
+
+    op.drop_column('movies', 'actor_count')
+    op.drop_column('actors', 'movie_count')
@@ -0,0 +1,70 @@
+"""association primary key, reverse index and cascading foreign keys
+
+Revision ID: 7d2f4b1c9a3e
+Revises: 499c332507bd
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f4b1c9a3e'
+down_revision = '499c332507bd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows with a missing side can't be part of the primary key
+    op.execute('DELETE FROM association '
+               'WHERE movie_id IS NULL OR actor_id IS NULL')
+    # keep a single row of every duplicated (movie_id, actor_id) pair
+    op.execute('DELETE FROM association a USING association b '
+               'WHERE a.movie_id = b.movie_id '
+               'AND a.actor_id = b.actor_id '
+               'AND a.ctid > b.ctid')
+
+    op.alter_column('association', 'movie_id',
+                    existing_type=sa.INTEGER(),
+                    nullable=False)
+    op.alter_column('association', 'actor_id',
+                    existing_type=sa.INTEGER(),
+                    nullable=False)
+    op.create_primary_key('association_pkey', 'association',
+                          ['movie_id', 'actor_id'])
+    op.create_index('ix_association_actor_id_movie_id', 'association',
+                    ['actor_id', 'movie_id'])
+
+    op.drop_constraint('association_movie_id_fkey', 'association',
+                       type_='foreignkey')
+    op.drop_constraint('association_actor_id_fkey', 'association',
+                       type_='foreignkey')
+    op.create_foreign_key('association_movie_id_fkey', 'association',
+                          'movies', ['movie_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_foreign_key('association_actor_id_fkey', 'association',
+                          'actors', ['actor_id'], ['id'],
+                          ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('association_actor_id_fkey', 'association',
+                       type_='foreignkey')
+    op.drop_constraint('association_movie_id_fkey', 'association',
+                       type_='foreignkey')
+    op.create_foreign_key('association_actor_id_fkey', 'association',
+                          'actors', ['actor_id'], ['id'])
+    op.create_foreign_key('association_movie_id_fkey', 'association',
+                          'movies', ['movie_id'], ['id'])
+
+    op.drop_index('ix_association_actor_id_movie_id',
+                  table_name='association')
+    op.drop_constraint('association_pkey', 'association', type_='primary')
+    op.alter_column('association', 'actor_id',
+                    existing_type=sa.INTEGER(),
+                    nullable=True)
+    op.alter_column('association', 'movie_id',
+                    existing_type=sa.INTEGER(),
+                    nullable=True)
@@ -0,0 +1,76 @@
+"""shard the table change counters
+
+Revision ID: 8e2c5a7f1b36
+Revises: 6a3d8b5f0e94
+Create Date: 2026-10-18 20:12:44.301529
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2c5a7f1b36'
+down_revision = '6a3d8b5f0e94'
+branch_labels = None
+depends_on = None
+
+SHARDS = 16
+
+
+def upgrade():
+    op.add_column('change_counters',
+                  sa.Column('shard', sa.SmallInteger(),
+                            server_default='0', nullable=False))
+    op.drop_constraint('change_counters_pkey', 'change_counters',
+                       type_='primary')
+    op.create_primary_key('change_counters_pkey', 'change_counters',
+                          ['table_name', 'shard'])
+    op.alter_column('change_counters', 'shard', server_default=None)
+
+    op.execute(f'''
+CREATE OR REPLACE FUNCTION bump_change_counter() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_counters (table_name, shard, counter)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % {SHARDS}, 1)
+    ON CONFLICT (table_name, shard)
+    DO UPDATE SET counter = change_counters.counter + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''')
+
+
+def downgrade():
+    op.execute('''
+CREATE OR REPLACE FUNCTION bump_change_counter() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_counters (table_name, counter)
+    VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name)
+    DO UPDATE SET counter = change_counters.counter + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''')
+
+    # fold the shards back into one row per table
+    op.execute('''
+UPDATE change_counters SET counter = totals.counter
+FROM (SELECT table_name, sum(counter) AS counter FROM change_counters
+      GROUP BY table_name) AS totals
+WHERE change_counters.table_name = totals.table_name
+AND change_counters.shard = (SELECT min(shard) FROM change_counters AS c
+                             WHERE c.table_name = totals.table_name)
+''')
+    op.execute('''
+DELETE FROM change_counters WHERE shard > (
+    SELECT min(shard) FROM change_counters AS c
+    WHERE c.table_name = change_counters.table_name)
+''')
+
+    op.drop_constraint('change_counters_pkey', 'change_counters',
+                       type_='primary')
+    op.drop_column('change_counters', 'shard')
+    op.create_primary_key('change_counters_pkey', 'change_counters',
+                          ['table_name'])
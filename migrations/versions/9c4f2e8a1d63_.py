@@ -0,0 +1,48 @@
+"""release_date as DATE, indexes for the movie filters and sorts
+
+Revision ID: 9c4f2e8a1d63
+Revises: 5e1a9c3d7b20
+Create Date: 2026-10-18 15:47:12.530871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4f2e8a1d63'
+down_revision = '5e1a9c3d7b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # models.py declares a DATE, comparing with a date no longer
+    # casts every row and the index on release_date is usable
+    op.alter_column('movies', 'release_date',
+                    existing_type=postgresql.TIMESTAMP(),
+                    type_=sa.Date(),
+                    existing_nullable=False,
+                    postgresql_using='release_date::date')
+    op.create_index('ix_movies_release_date_id', 'movies',
+                    ['release_date', 'id'], unique=False)
+    op.create_index('ix_movies_title_id', 'movies', ['title', 'id'],
+                    unique=False)
+    op.create_index('ix_movies_title_pattern', 'movies', ['title'],
+                    unique=False,
+                    postgresql_ops={'title': 'text_pattern_ops'})
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_movies_title_pattern', table_name='movies')
+    op.drop_index('ix_movies_title_id', table_name='movies')
+    op.drop_index('ix_movies_release_date_id', table_name='movies')
+    op.alter_column('movies', 'release_date',
+                    existing_type=sa.Date(),
+                    type_=postgresql.TIMESTAMP(),
+                    existing_nullable=False)
@@ -1,6 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine, Table
+from sqlalchemy import Column, String, Integer, create_engine, Table, and_
+from sqlalchemy import func, select, event, DDL
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import selectinload
 from flask_sqlalchemy import SQLAlchemy
 import json
 '''
@@ -25,12 +28,20 @@ def setup_db(app, database_path=database_path):
 
 '''
     Association Table for actor and movie (Many to Many) relationship
+    (movie_id, actor_id) is the primary key, the reverse index serves
+    the lookups by actor, rows are removed with their actor or movie
 '''
 association_table = db.Table('association',
                              db.Column('movie_id', db.Integer,
-                                       db.ForeignKey('movies.id')),
+                                       db.ForeignKey('movies.id',
+                                                     ondelete='CASCADE'),
+                                       primary_key=True),
                              db.Column('actor_id', db.Integer,
-                                       db.ForeignKey('actors.id'))
+                                       db.ForeignKey('actors.id',
+                                                     ondelete='CASCADE'),
+                                       primary_key=True),
+                             db.Index('ix_association_actor_id_movie_id',
+                                      'actor_id', 'movie_id')
                              )
 
 
@@ -46,17 +57,53 @@ class Movie(db.Model):
     # release date
     release_date = db.Column(db.Date(), nullable=False)
 
+    # Row version, increased by the database on every update
+    version = db.Column(db.Integer(), nullable=False, server_default='1')
+
+    # Number of actors in the cast, kept by the database
+    actor_count = db.Column(db.Integer(), nullable=False, server_default='0')
+
+    # ORM updates only apply to the version they loaded,
+    # the version is read back with RETURNING
+    __mapper_args__ = {
+        'version_id_col': version,
+        'version_id_generator': False,
+        'eager_defaults': True
+    }
+
+    # Serve the release date range, the title prefix and the sorted
+    # pages, the trigram index of the title search needs pg_trgm and
+    # is only created by the migration
+    __table_args__ = (
+        db.Index('ix_movies_release_date_id', 'release_date', 'id'),
+        db.Index('ix_movies_title_id', 'title', 'id'),
+        db.Index('ix_movies_title_pattern', 'title',
+                 postgresql_ops={'title': 'text_pattern_ops'}),
+        db.Index('ix_movies_actor_count_id', 'actor_count', 'id'),
+    )
+
     # Create relationship between movie and actor
     actors = db.relationship(
         'Actor',
         secondary=association_table,
-        backref=db.backref('movies', cascade="all, delete", lazy='joined'))
+        passive_deletes=True,
+        backref='movies')
 
     # Movie Constructor
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    '''
+        Loading strategies, the relationships are lazy by default so
+        every endpoint has to pick how the other side is loaded
+    '''
+
+    # Query movies with their actors loaded in one extra SELECT ... IN
+    @classmethod
+    def with_actors(cls):
+        return cls.query.options(selectinload(cls.actors))
+
     # Insert new Movie into database
     def insert(self):
         db.session.add(self)
@@ -64,15 +111,11 @@ class Movie(db.Model):
 
     # Add new relationship between movie and actor
     def add_actor(self, actor):
-        if actor not in self.actors:
-            self.actors.append(actor)
-        self.update()
+        add_assignment(self.id, actor.id)
 
     # Delete the relationship between movie and actor
     def delete_actor(self, actor):
-        if actor in self.actors:
-            self.actors.remove(actor)
-        self.update()
+        remove_assignment(self.id, actor.id)
 
     # Get list movie's actors
     def get_actors(self):
@@ -100,6 +143,8 @@ class Movie(db.Model):
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
+            'version': self.version,
+            'actor_count': self.actor_count,
         }
 
     def __repr__(self):
@@ -122,24 +167,47 @@ class Actor(db.Model):
     # Gender String
     gender = db.Column(db.String(), nullable=False)
 
+    # Row version, increased by the database on every update
+    version = db.Column(db.Integer(), nullable=False, server_default='1')
+
+    # Number of movies of the actor, kept by the database
+    movie_count = db.Column(db.Integer(), nullable=False, server_default='0')
+
+    # ORM updates only apply to the version they loaded,
+    # the version is read back with RETURNING
+    __mapper_args__ = {
+        'version_id_col': version,
+        'version_id_generator': False,
+        'eager_defaults': True
+    }
+
+    # Serve the gender and age filters and the movie_count sort, the
+    # trigram index of the name filter needs pg_trgm and is only
+    # created by the migration
+    __table_args__ = (
+        db.Index('ix_actors_gender_age', 'gender', 'age'),
+        db.Index('ix_actors_movie_count_id', 'movie_count', 'id'),
+    )
+
     # Actor Constructor
     def __init__(self, name, age, gender):
         self.name = name
         self.age = age
         self.gender = gender
 
+    # Query actors with their movies loaded in one extra SELECT ... IN
+    @classmethod
+    def with_movies(cls):
+        return cls.query.options(selectinload(cls.movies))
+
     # Add new relationship between movie and actor
     def add_movie(self, movie):
-        if movie not in self.movies:
-            self.movies.append(movie)
-        self.update()
+        add_assignment(movie.id, self.id)
 
     # Delete the relationship between movie and actor
 
     def delete_movie(self, movie):
-        if movie in self.movies:
-            self.movies.remove(movie)
-        self.update()
+        remove_assignment(movie.id, self.id)
 
     # Get list actor's movies
     def get_movies(self):
@@ -173,7 +241,364 @@ class Actor(db.Model):
             'name': self.name,
             'age': self.age,
             'gender': self.gender,
+            'version': self.version,
+            'movie_count': self.movie_count,
         }
 
     def __repr__(self):
         return json.dumps(self.format())
+
+
+'''
+    Change tracking, used for the ETags.
+    A BEFORE UPDATE trigger increases the version of every updated
+    actor and movie row, and a statement level trigger increases the
+    counter of actors, movies and association in change_counters after
+    every statement writing to them, whoever runs the statement.
+    Each table's counter is split in CHANGE_COUNTER_SHARDS rows picked
+    by the backend pid, so concurrent writers don't queue on one row,
+    and it's read as their sum. It stays transactional, a reader never
+    sees the counter of a write that isn't committed.
+    The same DDL is in the migrations 2b8e6f0d4c71 and 8e2c5a7f1b36
+
+    Cast counters, a statement level trigger on association adds the
+    inserted rows to and subtracts the deleted rows from movie_count
+    and actor_count, grouped by actor and by movie (transition tables),
+    so every path (assign, bulk, import, cascading deletes) keeps them.
+    A counter update alone doesn't increase the row version.
+    The same DDL is in the migration 6a3d8b5f0e94
+'''
+CHANGE_COUNTER_SHARDS = 16
+
+change_counters = db.Table('change_counters',
+                           db.Column('table_name', db.String(64),
+                                     primary_key=True),
+                           db.Column('shard', db.SmallInteger,
+                                     primary_key=True),
+                           db.Column('counter', db.BigInteger,
+                                     nullable=False, server_default='0')
+                           )
+
+event.listen(db.metadata, 'before_create', DDL('''
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_change_counter() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_counters (table_name, shard, counter)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() %% %(shards)s, 1)
+    ON CONFLICT (table_name, shard)
+    DO UPDATE SET counter = change_counters.counter + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_cast() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE movies SET actor_count = movies.actor_count - changed.count
+        FROM (SELECT movie_id, count(*) AS count FROM old_rows
+              GROUP BY movie_id) AS changed
+        WHERE movies.id = changed.movie_id;
+        UPDATE actors SET movie_count = actors.movie_count - changed.count
+        FROM (SELECT actor_id, count(*) AS count FROM old_rows
+              GROUP BY actor_id) AS changed
+        WHERE actors.id = changed.actor_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE movies SET actor_count = movies.actor_count + changed.count
+        FROM (SELECT movie_id, count(*) AS count FROM new_rows
+              GROUP BY movie_id) AS changed
+        WHERE movies.id = changed.movie_id;
+        UPDATE actors SET movie_count = actors.movie_count + changed.count
+        FROM (SELECT actor_id, count(*) AS count FROM new_rows
+              GROUP BY actor_id) AS changed
+        WHERE actors.id = changed.actor_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''', context={'shards': CHANGE_COUNTER_SHARDS}).execute_if(
+    dialect='postgresql'))
+
+for table, counter in ((Actor.__table__, 'movie_count'),
+                       (Movie.__table__, 'actor_count')):
+    event.listen(table, 'after_create', DDL(
+        'CREATE TRIGGER %(table)s_version BEFORE UPDATE ON %(table)s '
+        f'FOR EACH ROW WHEN (OLD.{counter} IS NOT DISTINCT FROM '
+        f'NEW.{counter}) EXECUTE PROCEDURE bump_row_version()'
+    ).execute_if(dialect='postgresql'))
+
+event.listen(association_table, 'after_create', DDL('''
+CREATE TRIGGER association_count_insert AFTER INSERT ON association
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE count_cast();
+
+CREATE TRIGGER association_count_update AFTER UPDATE ON association
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE count_cast();
+
+CREATE TRIGGER association_count_delete AFTER DELETE ON association
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE PROCEDURE count_cast();
+''').execute_if(dialect='postgresql'))
+
+for table in (Actor.__table__, Movie.__table__, association_table):
+    event.listen(table, 'after_create', DDL(
+        'CREATE TRIGGER %(table)s_changes '
+        'AFTER INSERT OR UPDATE OR DELETE ON %(table)s '
+        'FOR EACH STATEMENT EXECUTE PROCEDURE bump_change_counter()'
+    ).execute_if(dialect='postgresql'))
+
+
+# Get the change counters of tables in one query
+def get_change_counters(*tables):
+    counters = dict(db.session.query(
+        change_counters.c.table_name,
+        func.sum(change_counters.c.counter)).filter(
+        change_counters.c.table_name.in_(tables)).group_by(
+        change_counters.c.table_name))
+    return [int(counters.get(table, 0)) for table in tables]
+
+
+# Get the version of a row and the change counters of the tables
+# embedded in its responses in one query, version is None if the row
+# doesn't exist
+def get_row_version(model, id, *tables):
+    counters = [select([func.sum(change_counters.c.counter)]).where(
+        change_counters.c.table_name == table).as_scalar()
+        for table in tables]
+    row = db.session.query(
+        select([model.version]).where(model.id == id).as_scalar(),
+        *counters).one()
+    return row[0], [int(counter or 0) for counter in row[1:]]
+
+
+'''
+    Single statement update, one UPDATE ... RETURNING applied only to
+    expected_version when it's given. related is a pair of association
+    columns (matching this row, to return) and the ids of the related
+    rows are returned by the same statement. Returns the updated row as
+    a dict and the related ids, or (None, []) if no row matched.
+    The transaction is left open
+'''
+
+
+def update_row(model, id, values, expected_version=None, related=None):
+    table = model.__table__
+    statement = table.update().where(table.c.id == id)
+    if expected_version is not None:
+        statement = statement.where(table.c.version == expected_version)
+    if not values:
+        values = {'id': table.c.id}  # nothing to change, touch the row
+    updated = statement.values(values).returning(*table.c).cte('updated')
+
+    columns = [updated]
+    if related is not None:
+        match, other = related
+        columns.append(select([func.array_agg(other)]).where(
+            match == updated.c.id).label('related_ids'))
+
+    row = db.session.execute(select(columns)).first()
+    if row is None:
+        return None, []
+
+    updated_row = {column.name: row[column.name] for column in table.c}
+    related_ids = row['related_ids'] if related is not None else None
+    return updated_row, related_ids or []
+
+
+'''
+    Single statement delete, one DELETE ... RETURNING. The association
+    rows go with the deleted row (ON DELETE CASCADE), related works as
+    in update_row and the related ids are read from the snapshot before
+    the delete by the same statement. Returns if a row was deleted and
+    the related ids. The transaction is left open
+'''
+
+
+def delete_row(model, id, related=None):
+    table = model.__table__
+    deleted = table.delete().where(table.c.id == id).returning(
+        table.c.id).cte('deleted')
+
+    columns = [deleted.c.id]
+    if related is not None:
+        match, other = related
+        columns.append(select([func.array_agg(other)]).where(
+            match == deleted.c.id).label('related_ids'))
+
+    row = db.session.execute(select(columns)).first()
+    if row is None:
+        return False, []
+
+    related_ids = row['related_ids'] if related is not None else None
+    return True, related_ids or []
+
+
+'''
+    Recompute movie_count and actor_count from the association table,
+    one UPDATE per table writing only the rows that drifted. Their
+    version is increased so their ETags change. Movies are locked
+    before actors, in the order of the count_cast trigger, so it can't
+    deadlock with a concurrent assignment. Returns the number of fixed
+    actors and movies
+'''
+
+
+def reconcile_counts():
+    fixed = []
+    for model, counter, match in (
+            (Movie, 'actor_count', association_table.c.movie_id),
+            (Actor, 'movie_count', association_table.c.actor_id)):
+        table = model.__table__
+        counts = select([
+            table.c.id, func.count(match).label('count')
+        ]).select_from(
+            table.outerjoin(association_table, match == table.c.id)
+        ).group_by(table.c.id).alias('counts')
+
+        result = db.session.execute(table.update().where(and_(
+            table.c.id == counts.c.id,
+            table.c[counter] != counts.c.count
+        )).values({
+            counter: counts.c.count,
+            'version': table.c.version + 1
+        }))
+        fixed.append(result.rowcount)
+
+    db.session.commit()
+    movies_fixed, actors_fixed = fixed
+    return actors_fixed, movies_fixed
+
+
+# Check if a row exists
+def row_exists(model, id):
+    return db.session.query(
+        db.session.query(model.id).filter(model.id == id).exists()).scalar()
+
+
+'''
+    Set based assignment, the association row is written or removed
+    with one statement without loading either side's collection
+'''
+
+
+# Add the relationship, returns False if it already existed.
+# Raises IntegrityError if the movie or the actor doesn't exist
+def add_assignment(movie_id, actor_id):
+    statement = insert(association_table).values(
+        movie_id=movie_id,
+        actor_id=actor_id
+    ).on_conflict_do_nothing()
+
+    result = db.session.execute(statement)
+    db.session.commit()
+    return result.rowcount == 1
+
+
+# Remove the relationship, returns False if it didn't exist
+def remove_assignment(movie_id, actor_id):
+    statement = association_table.delete().where(and_(
+        association_table.c.movie_id == movie_id,
+        association_table.c.actor_id == actor_id
+    ))
+
+    result = db.session.execute(statement)
+    db.session.commit()
+    return result.rowcount == 1
+
+
+# Check if both the movie and the actor exist in one query
+def movie_and_actor_exist(movie_id, actor_id):
+    movie = db.session.query(Movie.id).filter(Movie.id == movie_id)
+    actor = db.session.query(Actor.id).filter(Actor.id == actor_id)
+
+    movie_exists, actor_exists = db.session.query(
+        movie.exists(), actor.exists()).one()
+    return movie_exists and actor_exists
+
+
+# Add many relationships at once, pairs is a list of
+# (movie_id, actor_id). The ids are checked with one IN query per table
+# (locked against concurrent deletes) and every new row is written with
+# one multi-row INSERT. Returns the status of every pair in order
+def add_assignments(pairs):
+    movie_ids = {movie_id for movie_id, actor_id in pairs}
+    actor_ids = {actor_id for movie_id, actor_id in pairs}
+
+    found_movies = {movie_id for (movie_id,) in db.session.query(
+        Movie.id).filter(Movie.id.in_(movie_ids)).with_for_update(
+        key_share=True)}
+    found_actors = {actor_id for (actor_id,) in db.session.query(
+        Actor.id).filter(Actor.id.in_(actor_ids)).with_for_update(
+        key_share=True)}
+
+    # pairs to insert, without duplicates and in request order
+    valid = [pair for pair in dict.fromkeys(pairs)
+             if pair[0] in found_movies and pair[1] in found_actors]
+
+    inserted = set()
+    if valid:
+        statement = insert(association_table).values([
+            {'movie_id': movie_id, 'actor_id': actor_id}
+            for movie_id, actor_id in valid
+        ]).on_conflict_do_nothing().returning(
+            association_table.c.movie_id,
+            association_table.c.actor_id)
+        inserted = {tuple(row) for row in db.session.execute(statement)}
+    db.session.commit()
+
+    results = []
+    for movie_id, actor_id in pairs:
+        if movie_id not in found_movies:
+            status = 'movie_not_found'
+        elif actor_id not in found_actors:
+            status = 'actor_not_found'
+        elif (movie_id, actor_id) in inserted:
+            status = 'assigned'
+        else:
+            status = 'already_assigned'
+        results.append({
+            'movie_id': movie_id,
+            'actor_id': actor_id,
+            'status': status
+        })
+    return results
+
+
+'''
+    Bulk insert, every row is written by one multi-row
+    INSERT ... RETURNING in the current transaction.
+    With upsert_on='id' rows whose id already exists are updated
+    instead (ON CONFLICT (id) DO UPDATE)
+'''
+
+
+def bulk_insert(model, rows, upsert_on=None):
+    table = model.__table__
+    statement = insert(table).values(rows)
+
+    if upsert_on == 'id':
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={column: statement.excluded[column]
+                  for column in rows[0] if column != 'id'})
+
+    result = db.session.execute(statement.returning(*table.c))
+    inserted = [dict(row) for row in result]
+
+    if upsert_on == 'id':
+        # explicit ids don't move the serial sequence, so move it past
+        # them or the next plain insert would collide
+        db.session.execute(select([func.setval(
+            func.pg_get_serial_sequence(table.name, 'id'),
+            func.coalesce(select([func.max(table.c.id)]).as_scalar(), 1)
+        )]))
+
+    db.session.commit()
+    return inserted
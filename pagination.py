@@ -0,0 +1,131 @@
+import base64
+import json
+import os
+from datetime import date
+from flask import request, abort
+from sqlalchemy import tuple_
+from models import db
+from filters import get_int_arg
+
+'''
+    Keyset (cursor) pagination for the list endpoints.
+    Pages are ordered by id, or by a sort column then id, and the next
+    page starts after the last key of the current one, so every page
+    costs an index range scan no matter how deep it is (no OFFSET).
+'''
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+
+'''
+    cursors are opaque to the clients, they are the last key of the
+    page encoded as url safe base64 json, the id alone or a list of
+    the sort value and the id
+'''
+
+
+def encode_cursor(key):
+    data = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padding = '=' * (-len(cursor) % 4)
+    data = base64.urlsafe_b64decode(cursor + padding)
+    return json.loads(data.decode('utf-8'))
+
+
+'''
+    read limit and after from the query string,
+    abort with 400 if any of them is invalid
+    or after is not a key of columns
+'''
+
+
+def get_page_args(columns):
+    limit = get_int_arg('limit')
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit < 1:
+        abort(400)  # bad request
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            after = decode_cursor(after)
+        except Exception:
+            abort(400)  # bad request
+        after = load_key(columns, after)
+
+    return limit, after
+
+
+'''
+    the json value of a key column
+'''
+
+
+def dump_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+'''
+    the python value of a key column from its json value,
+    abort with 400 if it's not of the column's type
+'''
+
+
+def load_value(column, value):
+    python_type = column.type.python_type
+    if python_type is date:
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError):
+            abort(400)  # bad request
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        abort(400)  # bad request
+    return value
+
+
+def load_key(columns, key):
+    if len(columns) == 1:
+        return [load_value(columns[0], key)]
+    if not isinstance(key, list) or len(key) != len(columns):
+        abort(400)  # bad request
+    return [load_value(column, value) for column, value in zip(columns, key)]
+
+
+'''
+    return the rows of one page of a Core select ordered by columns and
+    the cursor of the next page (None on the last page), the last
+    column must be unique (the id) so that the key of every row is
+    unique
+'''
+
+
+def paginate(statement, *columns, descending=False):
+    limit, after = get_page_args(columns)
+
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    if after is not None:
+        after = tuple_(*after) if len(columns) > 1 else after[0]
+        statement = statement.where(
+            key < after if descending else key > after)
+
+    # fetch one extra row to know if there is a next page
+    order = [column.desc() if descending else column for column in columns]
+    rows = db.session.execute(
+        statement.order_by(*order).limit(limit + 1)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = [dump_value(getattr(rows[-1], column.key))
+                for column in columns]
+        next_cursor = encode_cursor(last if len(columns) > 1 else last[0])
+
+    return rows, next_cursor
@@ -0,0 +1,74 @@
+import gc
+import time
+import tracemalloc
+from app import APP, format_actor, format_movie
+from models import db, Actor, Movie
+from dto import actor_page, movie_page
+from pagination import MAX_PAGE_SIZE
+
+'''
+    Benchmark of the list endpoints read path, one page of actors or
+    movies with the other side loaded and formatted, through the ORM
+    (instrumented instances in the identity map) and through the Core
+    select() and __slots__ rows of dto.py.
+    Reports the time per page and the memory allocated while reading
+    and formatting it.
+'''
+
+KINDS = {
+    'actors': (Actor.with_movies, Actor.id, format_actor, actor_page),
+    'movies': (Movie.with_actors, Movie.id, format_movie, movie_page)
+}
+
+
+def orm_page(kind, rows):
+    query, id, format, page = KINDS[kind]
+    return [format(row) for row in query().order_by(id).limit(rows).all()]
+
+
+def dto_page(kind, rows):
+    query, id, format, page = KINDS[kind]
+    with APP.test_request_context(f'/?limit={rows}'):
+        items, next_cursor = page([], (id,))
+        return [format(row) for row in items]
+
+
+'''
+    time and trace the allocations of read(kind, rows), the session is
+    emptied before every run so the ORM starts with an empty identity
+    map as it does in a request
+'''
+
+
+def measure(read, kind, rows, repeats):
+    seconds = []
+    peak = 0
+    for i in range(repeats):
+        db.session.remove()
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        read(kind, rows)
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        'ms_per_page': min(seconds) * 1000,
+        'peak_kb': peak / 1024
+    }
+
+
+'''
+    rows is at most MAX_PAGE_SIZE, the page size the endpoints (and so
+    dto_page) are capped at, both paths read the same rows
+'''
+
+
+def run(kind, rows, repeats):
+    if not 1 <= rows <= MAX_PAGE_SIZE:
+        raise ValueError(f'rows must be between 1 and {MAX_PAGE_SIZE}')
+    with APP.app_context():
+        return {
+            'orm': measure(orm_page, kind, rows, repeats),
+            'dto': measure(dto_page, kind, rows, repeats)
+        }
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from itertools import chain
+from flask import g, request, Response
+from sqlalchemy import event
+
+try:
+    import redis
+except ImportError:  # the shared store is optional
+    redis = None
+
+'''
+    Read-through cache of GET responses.
+    Every cached view depends on tags ('catalog' for the list endpoints,
+    'actor:<id>' / 'movie:<id>' for the detail endpoints), each tag has
+    a generation number and the generations are part of the cache key.
+    Writes invalidate tags by bumping their generation once their
+    transaction commits, so stale entries are never read again and age
+    out of the backend on their own.
+    The generations only see the writes of this process (or of every
+    worker with the shared backend), so the ETag the database computed
+    for the request (etags.conditional) is part of the key too: writes
+    by other workers, the manage.py commands or plain SQL change it and
+    a stale body can't be served. Views without an ETag aren't cached.
+'''
+
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'lru')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+# bumped by writes that can touch any row (bulk upserts, imports)
+EPOCH_TAG = 'epoch'
+
+
+# Backends
+
+'''
+LRUBackend
+In-process cache, the entries are only seen by the worker that wrote
+them and only its own writes bump their generations, the ETag in the
+key keeps them fresh across workers
+'''
+
+
+class LRUBackend:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+
+'''
+LocalStore
+Stand-in for the shared store when no RESPONSE_CACHE_URL is configured
+or the redis package isn't installed, it implements the few redis
+commands SharedBackend uses
+'''
+
+
+class LocalStore:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._values.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            expires = time.time() + ex if ex else None
+            self._values[key] = (value, expires)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self._values.get(key, (0, None))
+            self._values[key] = (int(value) + 1, expires)
+            return int(value) + 1
+
+
+'''
+SharedBackend
+Cache shared by every worker, stored in redis (or a LocalStore)
+'''
+
+
+class SharedBackend:
+    def __init__(self, client, ttl=RESPONSE_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get('response:' + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.set('response:' + key, json.dumps(value), ex=self.ttl)
+
+    def generations(self, tags):
+        values = self.client.mget(['generation:' + tag for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        for tag in tags:
+            self.client.incr('generation:' + tag)
+
+
+'''
+    build the backend from the environment,
+    returns None when the cache is turned off
+'''
+
+
+def backend_from_env():
+    if RESPONSE_CACHE == 'off':
+        return None
+    if RESPONSE_CACHE == 'shared':
+        if redis is not None and RESPONSE_CACHE_URL:
+            return SharedBackend(redis.Redis.from_url(RESPONSE_CACHE_URL))
+        return SharedBackend(LocalStore())
+    return LRUBackend()
+
+
+'''
+ResponseCache
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    '''
+        the key is the route, the query string, the permissions of the
+        token, the ETag of the response and the generations of the tags
+        the view depends on
+    '''
+
+    def key(self, token, tags):
+        permissions = ','.join(sorted(token.get('permissions', [])))
+        generations = self.backend.generations(tags)
+        raw = '|'.join([
+            request.path,
+            '&'.join(sorted(request.query_string.decode().split('&'))),
+            permissions,
+            g.etag,
+            ','.join(f'{tag}:{generation}'
+                     for tag, generation in zip(tags, generations))
+        ])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    '''
+        decorator for views that come after requires_auth and
+        etags.conditional, tags(**kwargs) returns the tags the response
+        depends on, the cache is bypassed when unless() returns True or
+        there is no ETag
+    '''
+
+    def cached(self, tags, unless=None):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(token, *args, **kwargs):
+                if self.backend is None or (unless and unless()) or \
+                        g.get('etag') is None:
+                    return f(token, *args, **kwargs)
+
+                key = self.key(token, [EPOCH_TAG] + tags(**kwargs))
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return Response(entry['body'], status=entry['status'],
+                                    mimetype=entry['mimetype'])
+
+                self.misses += 1
+                response = f(token, *args, **kwargs)
+                if not isinstance(response, Response):
+                    return response
+                # only complete successful responses are kept
+                if response.status_code == 200 and \
+                        not response.is_streamed:
+                    self.backend.set(key, {
+                        'body': response.get_data(as_text=True),
+                        'status': response.status_code,
+                        'mimetype': response.mimetype
+                    })
+                return response
+
+            return wrapper
+        return cached_decorator
+
+    def invalidate(self, *tags):
+        if self.backend is not None and tags:
+            self.backend.bump(tags)
+
+    '''
+        invalidate tags once the transaction of session commits,
+        nothing is invalidated if it's rolled back
+    '''
+
+    def invalidate_on_commit(self, session, *tags):
+        session.info.setdefault('response_cache_tags', set()).update(tags)
+
+    '''
+        listen to the transactions of session, instance_tags(instance)
+        returns the tags of an inserted, updated or deleted ORM instance
+        so writes through the ORM invalidate on their own
+    '''
+
+    def init_session(self, session, instance_tags):
+        if event.contains(session, 'after_commit', self._after_commit):
+            return  # already listening, the app was created again
+        self._instance_tags = instance_tags
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        tags = set()
+        for instance in chain(session.new, session.dirty, session.deleted):
+            tags.update(self._instance_tags(instance))
+        if tags:
+            self.invalidate_on_commit(session, *tags)
+
+    def _after_commit(self, session):
+        tags = session.info.pop('response_cache_tags', None)
+        if tags:
+            self.invalidate(*tags)
+
+    def _after_rollback(self, session):
+        session.info.pop('response_cache_tags', None)
+
+
+response_cache = ResponseCache(backend_from_env())
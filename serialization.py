@@ -0,0 +1,53 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # the fast encoder is optional
+    orjson = None
+
+'''
+    JSON serialization of the responses.
+    Objects are encoded straight to UTF-8 bytes, with orjson when it's
+    installed and the standard library otherwise, and the bytes are the
+    body of the response (no intermediate str, no Flask JSON encoder).
+    Dates and datetimes are written as ISO 8601 by both encoders.
+'''
+
+JSON_MIMETYPE = 'application/json'
+
+
+# values neither encoder writes on its own
+def encode_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    # the keys of SQLAlchemy rows are str subclasses (quoted_name)
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        return orjson.dumps(data, default=encode_value,
+                            option=ORJSON_OPTIONS)
+else:
+    def dumps(data):
+        return json.dumps(data, default=encode_value, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+
+'''
+    the JSON response of data, used instead of flask.jsonify
+'''
+
+
+def json_response(data, status=200, headers=None):
+    return Response(dumps(data), status=status, headers=headers,
+                    mimetype=JSON_MIMETYPE)
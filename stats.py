@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from sqlalchemy import select, func, extract, cast, Integer
+from models import db, Actor, Movie
+
+'''
+    Catalog statistics for the dashboards.
+    Every figure is a GROUP BY aggregate computed by the database, and
+    the result is kept in memory for STATS_TTL seconds, so refreshing a
+    dashboard doesn't load the catalog.
+'''
+
+# How long (seconds) the statistics are served before they're recomputed
+STATS_TTL = int(os.environ.get('STATS_TTL', 60))
+# Width (years) of the age groups
+STATS_AGE_GROUP = int(os.environ.get('STATS_AGE_GROUP', 10))
+
+
+'''
+    compute the statistics, one aggregate query per distribution,
+    the cast sizes are the actor_count kept on every movie
+'''
+
+
+def catalog_stats(age_group=STATS_AGE_GROUP):
+    actors = Actor.__table__
+    movies = Movie.__table__
+
+    by_gender = db.session.execute(select([
+        actors.c.gender, func.count().label('count')
+    ]).group_by(actors.c.gender).order_by(actors.c.gender))
+
+    group = (actors.c.age / age_group * age_group).label('min_age')
+    by_age = db.session.execute(select([
+        group, func.count().label('count')
+    ]).group_by(group).order_by(group))
+
+    year = cast(extract('year', movies.c.release_date), Integer).label('year')
+    by_year = db.session.execute(select([
+        year,
+        func.count().label('movies'),
+        func.avg(movies.c.actor_count).label('average_cast')
+    ]).group_by(year).order_by(year))
+
+    by_gender = [dict(row) for row in by_gender]
+    by_age = [{
+        'min_age': row['min_age'],
+        'max_age': row['min_age'] + age_group - 1,
+        'count': row['count']
+    } for row in by_age]
+    by_year = [{
+        'year': row['year'],
+        'movies': row['movies'],
+        'average_cast': round(float(row['average_cast']), 2)
+    } for row in by_year]
+
+    return {
+        'actors': {
+            'count': sum(row['count'] for row in by_gender),
+            'by_gender': by_gender,
+            'by_age': by_age
+        },
+        'movies': {
+            'count': sum(row['movies'] for row in by_year),
+            'by_year': by_year
+        }
+    }
+
+
+'''
+StatsCache
+Keeps the last statistics for ttl seconds, only one thread recomputes
+them at a time, the others keep serving the previous ones.
+'''
+
+
+class StatsCache:
+    def __init__(self, ttl=STATS_TTL):
+        self.ttl = ttl
+        self._stats = None
+        self._computed_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.time() - self._computed_at >= self.ttl:
+            blocking = self._stats is None
+            if self._lock.acquire(blocking=blocking):
+                try:
+                    if time.time() - self._computed_at >= self.ttl:
+                        self._stats = catalog_stats()
+                        self._computed_at = time.time()
+                finally:
+                    self._lock.release()
+        return self._stats, self._computed_at
+
+    def invalidate(self):
+        self._computed_at = 0
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,39 @@
+import os
+from flask import request, Response, stream_with_context
+from serialization import dumps
+
+'''
+    Streaming (NDJSON) responses for full catalog dumps.
+    Rows are read from a server side cursor in batches of
+    STREAM_BATCH_SIZE and written one JSON document per line as soon as
+    they are serialized, so a worker never holds the whole table.
+'''
+
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+'''
+    return True if the client asked for a stream,
+    with ?stream=1 or with Accept: application/x-ndjson
+'''
+
+
+def wants_stream():
+    if request.args.get('stream') == '1':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+'''
+    stream every row of query as NDJSON, format turns a row into a dict
+'''
+
+
+def ndjson_response(query, format, batch_size=STREAM_BATCH_SIZE):
+    def generate():
+        for row in query.yield_per(batch_size):
+            yield dumps(format(row)) + b'\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE)
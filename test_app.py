@@ -1,10 +1,28 @@
+import datetime
+import io
 import os
+import tempfile
+import threading
+import time
 import unittest
 import json
+from unittest import mock
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.pool import NullPool
 
 from app import create_app
+from auth.auth import AuthError, JWKSStore, TokenCache, VerifiedToken
+from auth.auth import PermissionRegistry, check_permissions
+from auth.auth import permission_registry
+import auth.auth
 from models import setup_db, db, Actor, Movie, association_table
+from models import CHANGE_COUNTER_SHARDS
+from response_cache import response_cache, EPOCH_TAG
+from costars import CoStarGraph, costar_store
+from stats import stats_cache
+import csv_import
+import catalog_export
 
 producer_jwt = 'eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6ImtEeH\
 d5SGE1WUcwR3dmcHVhWWE2SSJ9.eyJpc3MiOiJodHRwczovL2Z\
@@ -98,6 +116,40 @@ class CapstoneTestCase(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        # the ids are reused by the next test, forget cached responses
+        response_cache.invalidate(EPOCH_TAG)
+        costar_store.invalidate()
+        stats_cache.invalidate()
+
+    # Count the SQL statements sent to the database while calling func
+    def count_queries(self, func):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    # Add count movies, each one with its own actor
+    def add_cast(self, count):
+        for i in range(count):
+            movie = Movie(
+                title=self.new_movie['title'],
+                release_date=self.new_movie['release_date'])
+            movie.insert()
+            actor = Actor(
+                name=self.new_actor['name'],
+                age=self.new_actor['age'],
+                gender=self.new_actor['gender'])
+            actor.insert()
+            movie.add_actor(actor)
 
     # -- Successful test for every Endpoint using jwt with producer premissions
 
@@ -124,6 +176,98 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertIsNotNone(data.get('actors'))
         self.assertEqual(len(data.get('actors')), 1)
 
+    # test walk through the actors page by page using next_cursor
+    def test_get_actors_pages(self):
+        for i in range(3):
+            actor = Actor(
+                name=self.new_actor['name'],
+                age=self.new_actor['age'],
+                gender=self.new_actor['gender'])
+            actor.insert()
+
+        ids = []
+        cursor = None
+        while True:
+            url = '/actors?limit=2'
+            if cursor is not None:
+                url += f'&after={cursor}'
+            response = self.client().get(
+                url, headers={'Authorization': f'Bearer {producer_jwt}'})
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(data.get('actors')), 2)
+            ids += [actor["actor's_information"]['id']
+                    for actor in data.get('actors')]
+
+            cursor = data.get('next_cursor')
+            if cursor is None:
+                break
+
+        # every actor is returned once and in order
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids, sorted(ids))
+
+    # test a page size that isn't a positive integer
+    def test_400_get_actors_limit(self):
+        for limit in ('abc', '0', '-1'):
+            response = self.client().get(
+                f'/actors?limit={limit}',
+                headers={'Authorization': f'Bearer {producer_jwt}'})
+
+            self.assertEqual(response.status_code, 400)
+
+    # test filter the actors by name, gender and age range
+    def test_get_actors_filters(self):
+        for name, age, gender in [('Anna', 30, 'female'),
+                                  ('Joanne', 40, 'female'),
+                                  ('Hanna', 28, 'male'),
+                                  ('Maria', 33, 'female')]:
+            Actor(name=name, age=age, gender=gender).insert()
+
+        response = self.client().get(
+            '/actors?name=ANN&gender=female&min_age=25&max_age=35',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [actor["actor's_information"]['name']
+             for actor in data.get('actors')], ['Anna'])
+
+    # test filter the actors with an invalid age
+    def test_400_get_actors_filters(self):
+        response = self.client().get(
+            '/actors?min_age=old',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+
+        self.assertEqual(response.status_code, 400)
+
+    # test stream every actor as NDJSON
+    def test_stream_actors(self):
+        self.add_cast(3)
+
+        response = self.client().get(
+            '/actors?stream=1',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        lines = response.data.decode('utf-8').splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            len(json.loads(lines[0])["actor's_movies"]['movies']), 1)
+
+    # test send invalid cursor
+    def test_400_get_actors_bad_cursor(self):
+        response = self.client().get(
+            '/actors?after=not-a-cursor',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data.get('success'), False)
+
     # test add new actor to the database
 
     def test_add_actor(self):
@@ -146,6 +290,100 @@ class CapstoneTestCase(unittest.TestCase):
         # check that question is not None
         self.assertIsNotNone(actor)
 
+    # test add many actors in one request
+    def test_add_actors_bulk(self):
+
+        # create the actors and load response data
+        response = self.client().post(
+            '/actors/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'actors': [self.new_actor] * 3})
+        data = json.loads(response.data)
+
+        # check status code and success message
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get('success'), True)
+
+        # see if the actors have been created
+        self.assertEqual(len(data.get('actors')), 3)
+        self.assertEqual(Actor.query.count(), 3)
+
+    # test nothing is added if one of the actors is invalid
+    def test_400_add_actors_bulk(self):
+
+        # create the actors and load response data
+        response = self.client().post(
+            '/actors/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'actors': [self.new_actor, {'name': 'no age'}]})
+        data = json.loads(response.data)
+
+        # check status code and the invalid actor
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data.get('success'), False)
+        self.assertEqual(data.get('invalid'), [1])
+        self.assertEqual(Actor.query.count(), 0)
+
+    # test an upsert writing the same id twice is rejected
+    def test_400_upsert_actors_bulk_duplicate_id(self):
+        actors = [dict(self.new_actor, id=id) for id in (1, 2, 1)]
+
+        # upsert the actors and load response data
+        response = self.client().post(
+            '/actors/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'actors': actors, 'upsert_on': 'id'})
+        data = json.loads(response.data)
+
+        # check status code and the items sharing an id
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data.get('success'), False)
+        self.assertEqual(data.get('invalid'), [0, 2])
+        self.assertEqual(Actor.query.count(), 0)
+
+    # test an upsert updates existing actors and the next insert
+    # gets an id after the upserted ones
+    def test_upsert_actors_bulk(self):
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        actor_id = actor.id
+
+        # update the actor and add one with an explicit id
+        response = self.client().post(
+            '/actors/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'actors': [dict(self.new_actor, id=actor_id, age=40),
+                             dict(self.new_actor, id=actor_id + 10)],
+                  'upsert_on': 'id'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Actor.query.get(actor_id).age, 40)
+        self.assertEqual(Actor.query.count(), 2)
+
+        # a plain insert doesn't collide with the explicit id
+        response = self.client().post(
+            '/actors/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'actors': [self.new_actor]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get('actors')[0]['id'], actor_id + 11)
+        self.assertEqual(Actor.query.count(), 3)
+
+    # test bulk requests whose body isn't a JSON object
+    def test_400_bulk_body(self):
+        for url in ('/actors/bulk', '/movies/bulk', '/assign/bulk'):
+            for body in ([self.new_actor], None):
+                response = self.client().post(
+                    url,
+                    headers={'Authorization': f'Bearer {producer_jwt}'},
+                    json=body)
+
+                self.assertEqual(response.status_code, 400)
+
     # Test get user information from database by id
     def test_get_actor_by_id(self):
         # Add new Actor to the database
@@ -224,8 +462,158 @@ class CapstoneTestCase(unittest.TestCase):
         # Check if the actor is edited
         self.assertIsNotNone(data.get('actor'))
         self.assertEqual(data.get('actor').get('name'), 'test PATCH')
-        self.assertEqual(data.get('actor').get('age'), actor.age)
-        self.assertEqual(data.get('actor').get('gender'), actor.gender)
+        self.assertEqual(data.get('actor').get('age'), self.new_actor['age'])
+        self.assertEqual(
+            data.get('actor').get('gender'), self.new_actor['gender'])
+
+    # test edit actor invalidates the cached actor
+    def test_get_actor_after_edit(self):
+        # Add new Actor to the database
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        actor_id = actor.id
+
+        # get the actor twice, the second response is cached
+        for i in range(2):
+            response = self.client().get(
+                'actors/{}'.format(actor_id),
+                headers={'Authorization': f'Bearer {producer_jwt}'})
+            self.assertEqual(response.status_code, 200)
+
+        # edit then get the actor again
+        self.client().patch(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'name': 'test PATCH'})
+        response = self.client().get(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        # check the edited actor is returned
+        self.assertEqual(
+            data.get("actor's_information").get('name'), 'test PATCH')
+
+    # test a write made outside this process isn't hidden by the cache
+    def test_get_actor_after_sql_edit(self):
+        # Add new Actor to the database
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        actor_id = actor.id
+
+        # get the actor twice, the second response is cached
+        for i in range(2):
+            response = self.client().get(
+                'actors/{}'.format(actor_id),
+                headers={'Authorization': f'Bearer {producer_jwt}'})
+            self.assertEqual(response.status_code, 200)
+
+        # edit the actor with plain SQL, no cache tag is invalidated
+        db.engine.execute(
+            Actor.__table__.update().where(Actor.id == actor_id).values(
+                name='test SQL'))
+        response = self.client().get(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        # check the edited actor is returned
+        self.assertEqual(
+            data.get("actor's_information").get('name'), 'test SQL')
+
+    # test get actor with the ETag of the last response returns 304
+    def test_304_get_actor_by_id(self):
+        # Add new Actor to the database
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        actor_id = actor.id
+
+        response = self.client().get(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        # Send the request again with the ETag
+        response = self.client().get(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}',
+                     'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # edit the actor, the ETag doesn't match anymore
+        self.client().patch(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'name': 'test PATCH'})
+        response = self.client().get(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}',
+                     'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get('ETag'), etag)
+
+    # test edit actor with an old version in If-Match
+    def test_412_edit_actor_by_id(self):
+        # Add new Actor to the database
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        actor_id, version = actor.id, actor.version
+
+        # the first edit with the current version succeeds
+        response = self.client().patch(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}',
+                     'If-Match': f'"{version}"'},
+            json={'name': 'first PATCH'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get('actor').get('version'), version + 1)
+
+        # the second edit of the same version fails
+        response = self.client().patch(
+            'actors/{}'.format(actor_id),
+            headers={'Authorization': f'Bearer {producer_jwt}',
+                     'If-Match': f'"{version}"'},
+            json={'name': 'second PATCH'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(data.get('success'), False)
+        self.assertEqual(
+            Actor.query.get(actor_id).name, 'first PATCH')
+
+    # test edit actor without a JSON body
+    def test_400_edit_actor_by_id(self):
+        # Add new Actor to the database
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+
+        # Send the request and load response data
+        response = self.client().patch(
+            'actors/{}'.format(actor.id),
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        # check status code and success message
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data.get('success'), False)
 
     # test get the list of movies from the database
 
@@ -250,6 +638,62 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertIsNotNone(data.get('movies'))
         self.assertEqual(len(data.get('movies')), 1)
 
+    # test the release date is written as ISO 8601
+    def test_get_movie_release_date(self):
+        movie = Movie(
+            title=self.new_movie['title'],
+            release_date=self.new_movie['release_date'])
+        movie.insert()
+
+        response = self.client().get(
+            f'/movies/{movie.id}',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(
+            data.get('movie_information')['release_date'], '2020-10-10')
+
+    # test filter the movies by release date and title,
+    # newest first and page by page
+    def test_get_movies_filters(self):
+        for title, release_date in [('Alien', '1979-05-25'),
+                                    ('Aliens', '1986-07-18'),
+                                    ('Alien 3', '1992-05-22'),
+                                    ('Heat', '1995-12-15'),
+                                    ('Alien Resurrection', '1997-11-26')]:
+            Movie(title=title, release_date=release_date).insert()
+
+        titles = []
+        cursor = None
+        while True:
+            url = ('/movies?title=Alien&released_after=1980-01-01'
+                   '&released_before=1995-12-31&sort=-release_date&limit=1')
+            if cursor is not None:
+                url += f'&after={cursor}'
+            response = self.client().get(
+                url, headers={'Authorization': f'Bearer {producer_jwt}'})
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            titles += [movie["movie's_information"]['title']
+                       for movie in data.get('movies')]
+
+            cursor = data.get('next_cursor')
+            if cursor is None:
+                break
+
+        self.assertEqual(titles, ['Alien 3', 'Aliens'])
+
+    # test sort the movies by an unknown column
+    def test_400_get_movies_sort(self):
+        response = self.client().get(
+            '/movies?sort=budget',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+
+        self.assertEqual(response.status_code, 400)
+
     # test add new Movie to the database
 
     def test_add_movie(self):
@@ -345,6 +789,40 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertIsNotNone(data.get('movie'))
         self.assertEqual(data.get('movie').get('title'), 'test PATCH')
 
+    # test the number of queries doesn't grow with the number of movies
+    def test_get_movies_query_count(self):
+        def get_movies():
+            db.session.expunge_all()
+            response = self.client().get(
+                '/movies',
+                headers={'Authorization': f'Bearer {producer_jwt}'})
+            self.assertEqual(response.status_code, 200)
+
+        self.add_cast(1)
+        few = self.count_queries(get_movies)
+
+        self.add_cast(5)
+        many = self.count_queries(get_movies)
+
+        self.assertEqual(few, many)
+
+    # test the number of queries doesn't grow with the number of actors
+    def test_get_actors_query_count(self):
+        def get_actors():
+            db.session.expunge_all()
+            response = self.client().get(
+                '/actors',
+                headers={'Authorization': f'Bearer {producer_jwt}'})
+            self.assertEqual(response.status_code, 200)
+
+        self.add_cast(1)
+        few = self.count_queries(get_actors)
+
+        self.add_cast(5)
+        many = self.count_queries(get_actors)
+
+        self.assertEqual(few, many)
+
     # Test assing relationship between movie and actor
     def test_assign(self):
         # Add new Actor to the database
@@ -359,14 +837,15 @@ class CapstoneTestCase(unittest.TestCase):
             title=self.new_movie['title'],
             release_date=self.new_movie['release_date'])
         movie.insert()
+        actor_id, movie_id = actor.id, movie.id
 
         # Send the request and load response data
         response = self.client().post(
             '/assign',
             headers={'Authorization': f'Bearer {producer_jwt}'},
             json={
-                'actor_id': actor.id,
-                'movie_id': movie.id
+                'actor_id': actor_id,
+                'movie_id': movie_id
             })
 
         data = json.loads(response.data)
@@ -376,6 +855,9 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data.get("success"), True)
 
         self.assertIsNotNone(data.get("movie's_actor"))
+        # reload them, the request closed the session they belong to
+        actor = Actor.query.get(actor_id)
+        movie = Movie.query.get(movie_id)
         self.assertIn(actor, movie.actors)
         self.assertIn(movie, actor.movies)
 
@@ -393,14 +875,15 @@ class CapstoneTestCase(unittest.TestCase):
             title=self.new_movie['title'],
             release_date=self.new_movie['release_date'])
         movie.insert()
+        actor_id, movie_id = actor.id, movie.id
 
         # Send the request and load response data
         response = self.client().delete(
             '/assign',
             headers={'Authorization': f'Bearer {producer_jwt}'},
             json={
-                'actor_id': actor.id,
-                'movie_id': movie.id
+                'actor_id': actor_id,
+                'movie_id': movie_id
             })
 
         data = json.loads(response.data)
@@ -410,10 +893,508 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data.get("success"), True)
 
         self.assertIsNotNone(data.get("movie's_actor"))
+        # reload them, the request closed the session they belong to
+        actor = Actor.query.get(actor_id)
+        movie = Movie.query.get(movie_id)
         self.assertNotIn(actor, movie.actors)
 
+    # Test assign an actor that doesn't exist
+    def test_404_assign(self):
+        # Add new Movie to the database
+        movie = Movie(
+            title=self.new_movie['title'],
+            release_date=self.new_movie['release_date'])
+        movie.insert()
+
+        # Send the request and load response data
+        response = self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'actor_id': 1000,
+                'movie_id': movie.id
+            })
+        data = json.loads(response.data)
+
+        # check status code and success message
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data.get("success"), False)
+
+    # Test assign the same actor twice keeps one relationship
+    def test_assign_twice(self):
+        self.add_cast(1)
+        movie_id = Movie.query.first().id
+        actor_id = Actor.query.first().id
+
+        # Send the request and load response data
+        response = self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'actor_id': actor_id,
+                'movie_id': movie_id
+            })
+        data = json.loads(response.data)
+
+        # check status code and success message
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get("movie's_actor").get('assigned'), False)
+        self.assertEqual(len(Movie.query.get(movie_id).actors), 1)
+
+    # Test assign many actors to a movie in one request
+    def test_assign_bulk(self):
+        self.add_cast(2)
+        movie_id = Movie.query.order_by(Movie.id).first().id
+        actor_ids = [actor.id for actor in Actor.query.order_by(Actor.id)]
+
+        # Send the request and load response data
+        response = self.client().post(
+            '/assign/bulk',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'movie_id': movie_id,
+                'actor_ids': actor_ids + [1000]
+            })
+        data = json.loads(response.data)
+
+        # check status code and success message
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get("success"), True)
+
+        # check the status of every pair
+        statuses = [result['status'] for result in data.get('results')]
+        self.assertEqual(statuses, [
+            'already_assigned', 'assigned', 'actor_not_found'])
+        self.assertEqual(len(Movie.query.get(movie_id).actors), 2)
+
+    # add an actor to two movies released a week apart
+    def add_busy_actor(self):
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        movie = Movie(title='first', release_date='2020-10-10')
+        movie.insert()
+        movie.add_actor(actor)
+        other_movie = Movie(title='second', release_date='2020-10-17')
+        other_movie.insert()
+        return actor.id, movie.id, other_movie.id
+
+    # Test reject an assign that conflicts with the actor's schedule
+    def test_409_assign_conflict(self):
+        actor_id, movie_id, other_movie_id = self.add_busy_actor()
+
+        response = self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'movie_id': other_movie_id,
+                'actor_id': actor_id,
+                'conflicts': 'reject'
+            })
+        data = json.loads(response.data)
+
+        # check status code, the conflict and that nothing was assigned
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(data.get('success'), False)
+        self.assertEqual(
+            [conflict['id'] for conflict in data.get('conflicts')],
+            [movie_id])
+        self.assertEqual(len(Movie.query.get(other_movie_id).actors), 0)
+
+    # Test an assign waits for a concurrent assign of the same actor
+    # and sees its conflict
+    def test_409_assign_conflict_concurrent(self):
+        actor = Actor(
+            name=self.new_actor['name'],
+            age=self.new_actor['age'],
+            gender=self.new_actor['gender'])
+        actor.insert()
+        movie = Movie(title='first', release_date='2020-10-10')
+        movie.insert()
+        other_movie = Movie(title='second', release_date='2020-10-17')
+        other_movie.insert()
+        actor_id, movie_id, other_movie_id = \
+            actor.id, movie.id, other_movie.id
+        db.session.remove()
+
+        # another transaction assigns the first movie and isn't done yet
+        engine = create_engine(db.engine.url, poolclass=NullPool)
+        connection = engine.connect()
+        transaction = connection.begin()
+        connection.execute(select([Actor.id]).where(
+            Actor.id == actor_id).with_for_update())
+        connection.execute(association_table.insert().values(
+            movie_id=movie_id, actor_id=actor_id))
+
+        responses = []
+
+        def assign():
+            responses.append(self.client().post(
+                '/assign',
+                headers={'Authorization': f'Bearer {producer_jwt}'},
+                json={
+                    'movie_id': other_movie_id,
+                    'actor_id': actor_id,
+                    'conflicts': 'reject'
+                }))
+            db.session.remove()
+
+        thread = threading.Thread(target=assign)
+        thread.start()
+        try:
+            # the request waits for the other transaction
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        finally:
+            transaction.commit()
+            connection.close()
+            engine.dispose()
+        thread.join()
+
+        # and then sees its assignment as a conflict
+        self.assertEqual(responses[0].status_code, 409)
+        self.assertEqual(len(Movie.query.get(other_movie_id).actors), 0)
+
+    # Test flag an assign that conflicts with the actor's schedule
+    def test_assign_conflict_flag(self):
+        actor_id, movie_id, other_movie_id = self.add_busy_actor()
+
+        response = self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'movie_id': other_movie_id,
+                'actor_id': actor_id,
+                'conflicts': 'flag'
+            })
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get("movie's_actor")['assigned'], True)
+        self.assertEqual(len(data.get('conflicts')), 1)
+
+        # the report finds the pair once
+        response = self.client().get(
+            '/conflicts',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(conflict['actor_id'], conflict['movie_id'],
+              conflict['other_movie_id'])
+             for conflict in data.get('conflicts')],
+            [(actor_id, movie_id, other_movie_id)])
+
+        # and none with a shorter window
+        response = self.client().get(
+            '/conflicts?window_days=3',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        self.assertEqual(json.loads(response.data).get('conflicts'), [])
+
+    # Test walk through the conflicts report page by page
+    def test_get_conflicts_pages(self):
+        actors = []
+        for i in range(2):
+            actor = Actor(name=f'actor {i}', age=30, gender='female')
+            actor.insert()
+            actors.append(actor.id)
+        movies = []
+        for release_date in ('2020-01-01', '2020-01-05', '2020-01-10'):
+            movie = Movie(title='movie', release_date=release_date)
+            movie.insert()
+            movies.append(movie.id)
+        # every actor is in every movie: 3 conflicts per actor
+        for movie_id in movies:
+            for actor_id in actors:
+                self.client().post(
+                    '/assign',
+                    headers={'Authorization': f'Bearer {producer_jwt}'},
+                    json={'actor_id': actor_id, 'movie_id': movie_id})
+
+        conflicts = []
+        cursor = None
+        while True:
+            url = '/conflicts?limit=2'
+            if cursor is not None:
+                url += f'&after={cursor}'
+            response = self.client().get(
+                url, headers={'Authorization': f'Bearer {producer_jwt}'})
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(data.get('conflicts')), 2)
+            conflicts += [(conflict['actor_id'], conflict['movie_id'],
+                           conflict['other_movie_id'])
+                          for conflict in data.get('conflicts')]
+
+            cursor = data.get('next_cursor')
+            if cursor is None:
+                break
+
+        # every conflict is returned once and in order
+        self.assertEqual(len(conflicts), 6)
+        self.assertEqual(conflicts, sorted(set(conflicts)))
+
+    # Test the cast counters follow assign, unassign and delete
+    def test_cast_counts(self):
+        self.add_cast(2)
+        movie_id, other_movie_id = [
+            movie.id for movie in Movie.query.order_by(Movie.id)]
+        actor_id, other_actor_id = [
+            actor.id for actor in Actor.query.order_by(Actor.id)]
+
+        self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'movie_id': movie_id, 'actor_id': other_actor_id})
+        self.assertEqual(Movie.query.get(movie_id).actor_count, 2)
+        self.assertEqual(Actor.query.get(other_actor_id).movie_count, 2)
+
+        # the busiest actor first
+        response = self.client().get(
+            '/actors?sort=-movie_count',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+        self.assertEqual(
+            [actor["actor's_information"]['movie_count']
+             for actor in data.get('actors')], [2, 1])
+
+        self.client().delete(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'movie_id': movie_id, 'actor_id': actor_id})
+        self.client().delete(
+            f'/actors/{other_actor_id}',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        self.assertEqual(Movie.query.get(movie_id).actor_count, 0)
+        self.assertEqual(Movie.query.get(other_movie_id).actor_count, 0)
+        self.assertEqual(Actor.query.get(actor_id).movie_count, 0)
+
+    # Test the co-stars and the shortest path of the in-memory graph
+    def test_co_star_graph(self):
+        # (movie_id, actor_id): 1 and 2 shared movies 1 and 4,
+        # 2 and 3 movie 2, 3 and 4 movie 3
+        graph = CoStarGraph.from_pairs([
+            (1, 1), (1, 2), (2, 2), (2, 3), (3, 3), (3, 4),
+            (4, 1), (4, 2), (5, 9)])
+
+        self.assertEqual(graph.co_stars(2, 10), [(1, 2), (3, 1)])
+        self.assertEqual(graph.path(1, 4), ([1, 2, 3, 4], [1, 2, 3]))
+        self.assertIsNone(graph.path(1, 9))
+
+        # the assigns and unassigns are applied on top of the indexes
+        graph.add(5, 1)
+        self.assertEqual(graph.path(1, 9), ([1, 9], [5]))
+        graph.remove(5, 1)
+        graph.remove(1, 1)
+        graph.remove(4, 1)
+        self.assertEqual(graph.co_stars(1, 10), [])
+        self.assertIsNone(graph.path(1, 4))
+
+    # Test the co-stars and path endpoints follow the assigns
+    def test_co_stars(self):
+        self.add_cast(2)
+        movie_id, other_movie_id = [
+            movie.id for movie in Movie.query.order_by(Movie.id)]
+        actor_id, other_actor_id = [
+            actor.id for actor in Actor.query.order_by(Actor.id)]
+
+        response = self.client().get(
+            f'/actors/{actor_id}/path/{other_actor_id}',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(data.get('degrees'))
+
+        self.client().post(
+            '/assign',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'movie_id': other_movie_id, 'actor_id': actor_id})
+
+        response = self.client().get(
+            f'/actors/{actor_id}/co-stars',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get('co_stars'), [{
+            'id': other_actor_id,
+            'name': self.new_actor['name'],
+            'shared_movies': 1
+        }])
+
+        response = self.client().get(
+            f'/actors/{actor_id}/path/{other_actor_id}',
+            headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+        self.assertEqual(data.get('degrees'), 1)
+        self.assertEqual(data.get('movies'), [other_movie_id])
+
+    # Test the graph is checked after its ttl once the association
+    # counter is split across shards by writes from other connections
+    def test_co_stars_counter_shards(self):
+        self.add_cast(3)
+        movie_ids = [movie.id for movie in Movie.query.order_by(Movie.id)]
+        actor_ids = [actor.id for actor in Actor.query.order_by(Actor.id)]
+        costar_store.graph()  # built before the other writes
+
+        # assign from new connections until two other shards were written
+        engine = create_engine(db.engine.url, poolclass=NullPool)
+        shards = set()
+        pairs = iter([(movie_ids[1], actor_ids[0]),
+                      (movie_ids[2], actor_ids[0])])
+        movie_id, actor_id = next(pairs)
+        try:
+            while len(shards) < 2:
+                with engine.begin() as connection:
+                    shard = connection.execute(select([
+                        func.pg_backend_pid() % CHANGE_COUNTER_SHARDS
+                    ])).scalar()
+                    if shard in shards:
+                        continue
+                    shards.add(shard)
+                    connection.execute(association_table.insert().values(
+                        movie_id=movie_id, actor_id=actor_id))
+                movie_id, actor_id = next(pairs, (None, None))
+        finally:
+            engine.dispose()
+
+        # once the ttl is over the summed counter shows the changes
+        costar_store._built_at = 0
+        for url in (f'/actors/{actor_ids[0]}/co-stars',
+                    f'/actors/{actor_ids[0]}/path/{actor_ids[2]}'):
+            response = self.client().get(
+                url, headers={'Authorization': f'Bearer {producer_jwt}'})
+            self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual(data.get('degrees'), 1)
+
+    # Test the statistics of the catalog
+    def test_get_stats(self):
+        self.add_cast(2)
+        Actor(name='Anna', age=31, gender='female').insert()
+        Movie(title='Heat', release_date='1995-12-15').insert()
+
+        response = self.client().get(
+            '/stats', headers={'Authorization': f'Bearer {producer_jwt}'})
+        data = json.loads(response.data)
+        stats = data.get('stats')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats['actors']['count'], 3)
+        self.assertEqual(stats['actors']['by_gender'], [
+            {'gender': 'female', 'count': 1},
+            {'gender': 'male', 'count': 2}])
+        self.assertEqual(stats['actors']['by_age'], [
+            {'min_age': 10, 'max_age': 19, 'count': 2},
+            {'min_age': 30, 'max_age': 39, 'count': 1}])
+        self.assertEqual(stats['movies']['by_year'], [
+            {'year': 1995, 'movies': 1, 'average_cast': 0.0},
+            {'year': 2020, 'movies': 2, 'average_cast': 1.0}])
+
+    # Test rank the actors that fit a role
+    def test_casting_match(self):
+        actors = {}
+        for name, age, gender in [('Busy', 30, 'female'),
+                                  ('Free', 30, 'female'),
+                                  ('Young', 26, 'female'),
+                                  ('Other', 30, 'male'),
+                                  ('Excluded', 30, 'female')]:
+            actors[name] = Actor(name=name, age=age, gender=gender)
+            actors[name].insert()
+        Movie(title='upcoming', release_date='2999-01-01').insert()
+        Movie(title='released', release_date='2001-01-01').insert()
+        Movie.query.filter(Movie.title == 'upcoming').one().add_actor(
+            actors['Busy'])
+        Movie.query.filter(Movie.title == 'released').one().add_actor(
+            actors['Free'])
+
+        # Send the request and load response data
+        response = self.client().post(
+            '/casting/match',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={
+                'gender': 'female',
+                'min_age': 25,
+                'max_age': 35,
+                'exclude': [actors['Excluded'].id],
+                'max_concurrent': 0
+            })
+        data = json.loads(response.data)
+
+        # check status code and the ranking
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [candidate['name'] for candidate in data.get('candidates')],
+            ['Free', 'Young'])
+        self.assertEqual(data.get('candidates')[0]['movie_count'], 1)
+
+    # Export the catalog with a token holding export:catalog,
+    # none of the test tokens has it
+    def export(self, url):
+        payload = {'sub': 'exporter', 'exp': time.time() + 60,
+                   'permissions': ['export:catalog']}
+        with mock.patch.object(auth.auth, 'verify_decode_jwt',
+                               return_value=payload):
+            return self.client().get(
+                url, headers={'Authorization': 'Bearer export-token'})
+
+    # Test export a table as NDJSON
+    def test_export(self):
+        self.add_cast(2)
+
+        response = self.export('/export/casting?format=ndjson')
+        rows = [json.loads(line) for line in
+                response.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(sorted(rows[0]), ['actor_id', 'movie_id'])
+
     # Unsuccessful test for every Endpoint using jwt with producer premissions
 
+    # test rank the actors of a role without an age range
+    def test_400_casting_match(self):
+        response = self.client().post(
+            '/casting/match',
+            headers={'Authorization': f'Bearer {producer_jwt}'},
+            json={'gender': 'female'})
+
+        self.assertEqual(response.status_code, 400)
+
+    # test a request while Auth0 is down and no key is cached
+    def test_503_auth0_down(self):
+        error = AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch signing keys.'
+        }, 503)
+        with mock.patch.object(auth.auth, 'verify_decode_jwt',
+                               side_effect=error):
+            response = self.client().get(
+                '/actors', headers={'Authorization': 'Bearer new-token'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(data.get('error'), 503)
+        self.assertEqual(
+            data.get('message'), 'Unable to fetch signing keys.')
+
+    # test export a table that doesn't exist
+    def test_404_export(self):
+        response = self.export('/export/users')
+
+        self.assertEqual(response.status_code, 404)
+
+    # test export in a format that doesn't exist
+    def test_400_export(self):
+        response = self.export('/export/actors?format=xml')
+
+        self.assertEqual(response.status_code, 400)
+
     # test send bad request (with out actor information)
     def test_401_add_actor(self):
 
@@ -534,5 +1515,378 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data.get("success"), False)
 
 
+class JWKSStoreTestCase(unittest.TestCase):
+    ''' Tests of the Auth0 key store, fetch is replaced so they
+    don't need the network '''
+
+    def setUp(self):
+        self.fetches = 0
+        self.down = False
+        self.kids = ['kid-1']
+
+    # stand-in for JWKSStore.fetch counting the fetches
+    def fetch(self):
+        self.fetches += 1
+        if self.down:
+            raise OSError('Auth0 is down')
+        return {kid: {'kid': kid} for kid in self.kids}
+
+    def store(self, **kwargs):
+        store = JWKSStore('https://example.invalid/jwks.json', **kwargs)
+        store.fetch = self.fetch
+        return store
+
+    # test the keys are fetched once and reused until the ttl
+    def test_get_key(self):
+        store = self.store()
+
+        self.assertEqual(store.get_key('kid-1'), {'kid': 'kid-1'})
+        self.assertEqual(store.get_key('kid-1'), {'kid': 'kid-1'})
+        self.assertEqual(self.fetches, 1)
+
+    # test expired keys are served while they are refreshed
+    def test_ttl_refresh(self):
+        store = self.store(ttl=60)
+        store.get_key('kid-1')
+        store._fetched_at -= 60
+        self.kids = ['kid-2']
+
+        # hold the refresh until the stale key was served
+        released = threading.Event()
+        fetch = self.fetch
+
+        def held_fetch():
+            released.wait()
+            return fetch()
+        store.fetch = held_fetch
+
+        # the stale key is served, the refresh runs in the background
+        self.assertEqual(store.get_key('kid-1'), {'kid': 'kid-1'})
+        released.set()
+        with store._lock:
+            pass  # wait for the background refresh
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(store.get_key('kid-2'), {'kid': 'kid-2'})
+        self.assertEqual(self.fetches, 2)
+
+    # test concurrent first requests fetch the keys once
+    def test_single_flight(self):
+        store = self.store()
+        fetch = self.fetch
+
+        def slow_fetch():
+            time.sleep(0.1)
+            return fetch()
+        store.fetch = slow_fetch
+
+        keys = []
+        threads = [threading.Thread(
+            target=lambda: keys.append(store.get_key('kid-1')))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(keys, [{'kid': 'kid-1'}] * 5)
+        self.assertEqual(self.fetches, 1)
+
+    # test an unknown kid forces a refresh at most once per interval
+    def test_unknown_kid_refresh(self):
+        store = self.store(min_refresh_interval=30)
+        store.get_key('kid-1')
+        store._last_attempt -= 30
+
+        # the first unknown kid refetches, the second one doesn't
+        self.assertIsNone(store.get_key('kid-2'))
+        self.assertIsNone(store.get_key('kid-3'))
+        self.assertEqual(self.fetches, 2)
+
+        # the rotated key is found once the interval has passed
+        self.kids = ['kid-1', 'kid-3']
+        store._last_attempt -= 30
+        self.assertEqual(store.get_key('kid-3'), {'kid': 'kid-3'})
+        self.assertEqual(self.fetches, 3)
+
+    # test the stale keys are served and the fetch backs off
+    # while Auth0 is down
+    def test_auth0_down(self):
+        store = self.store(ttl=60, retry_backoff=5)
+        store.get_key('kid-1')
+        store._fetched_at -= 60
+        self.down = True
+
+        # the failed refresh keeps the keys
+        store.refresh_in_background().join()
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(store.get_key('kid-1'), {'kid': 'kid-1'})
+
+        # no fetch until the backoff is over, then twice as long
+        self.assertEqual(self.fetches, 2)
+        store._retry_at -= 5
+        store.refresh_in_background().join()
+        self.assertEqual(self.fetches, 3)
+        self.assertGreaterEqual(store._retry_at - time.time(), 9)
+
+        # the next successful fetch resets the backoff
+        self.down = False
+        store._retry_at = 0
+        store.refresh_in_background().join()
+        self.assertEqual(self.fetches, 4)
+        self.assertEqual(store._retry_at, 0)
+
+    # test there is no key to serve when Auth0 is down from the start
+    def test_503_auth0_down(self):
+        store = self.store(retry_backoff=5)
+        self.down = True
+
+        for i in range(2):
+            with self.assertRaises(AuthError) as error:
+                store.get_key('kid-1')
+            self.assertEqual(error.exception.status_code, 503)
+        # the second request didn't wait for another fetch
+        self.assertEqual(self.fetches, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    ''' Tests of the verified token cache '''
+
+    # a verified token of sub valid for seconds
+    def verified(self, sub='user', seconds=60):
+        return VerifiedToken({
+            'sub': sub,
+            'exp': time.time() + seconds,
+            'permissions': ['get:actors']
+        })
+
+    # test a cached token is returned and counted as a hit
+    def test_get(self):
+        cache = TokenCache()
+        verified = self.verified()
+
+        self.assertIsNone(cache.get('token'))
+        cache.put('token', verified)
+        self.assertIs(cache.get('token'), verified)
+        self.assertEqual(cache.stats(), {
+            'size': 1, 'maxsize': cache.maxsize, 'hits': 1, 'misses': 1})
+
+    # test the least recently used token is evicted at maxsize
+    def test_eviction(self):
+        cache = TokenCache(maxsize=2)
+        cache.put('first', self.verified())
+        cache.put('second', self.verified())
+
+        # using first makes second the least recently used
+        cache.get('first')
+        cache.put('third', self.verified())
+
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('third'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+    # test a token isn't returned once it expired
+    def test_expiry(self):
+        cache = TokenCache()
+        cache.put('token', self.verified(seconds=-1))
+
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['size'], 0)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    # test a token without exp is never cached
+    def test_no_exp(self):
+        cache = TokenCache()
+        cache.put('token', VerifiedToken({'sub': 'user'}))
+
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    # test every token of a subject is evicted
+    def test_evict_subject(self):
+        cache = TokenCache()
+        cache.put('first', self.verified('user'))
+        cache.put('second', self.verified('user'))
+        cache.put('third', self.verified('other'))
+
+        self.assertEqual(cache.evict_subject('user'), 2)
+        self.assertIsNone(cache.get('first'))
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('third'))
+        self.assertEqual(cache.evict_subject('user'), 0)
+
+
+class PermissionsTestCase(unittest.TestCase):
+    ''' Tests of the permission bit masks '''
+
+    # test every permission gets its own bit, once
+    def test_register(self):
+        registry = PermissionRegistry()
+        read = registry.register('get:actors')
+        write = registry.register('add:actor')
+
+        self.assertNotEqual(read, write)
+        self.assertEqual(read & write, 0)
+        self.assertEqual(registry.register('get:actors'), read)
+        self.assertEqual(registry.scopes(), ['add:actor', 'get:actors'])
+
+    # test permissions nobody requires are left out of the mask
+    def test_mask(self):
+        registry = PermissionRegistry()
+        read = registry.register('get:actors')
+
+        self.assertEqual(registry.mask(['get:actors', 'unknown']), read)
+        self.assertEqual(registry.mask([]), 0)
+
+    # test a token is allowed with the required permission
+    def test_check_permissions(self):
+        required = permission_registry.register('get:actors')
+        verified = VerifiedToken({'permissions': ['get:actors']})
+
+        self.assertTrue(check_permissions(required, verified))
+
+    # test the mask of a token follows permissions registered after it
+    def test_check_permissions_new_scope(self):
+        verified = VerifiedToken({'permissions': ['test:scope']})
+        verified.mask  # compiled before test:scope is registered
+        required = permission_registry.register('test:scope')
+
+        self.assertTrue(check_permissions(required, verified))
+
+    # test a token without the required permission is denied
+    def test_403_check_permissions(self):
+        required = permission_registry.register('delete:movie')
+        verified = VerifiedToken({'permissions': ['get:actors']})
+
+        with self.assertRaises(AuthError) as error:
+            check_permissions(required, verified)
+        self.assertEqual(error.exception.status_code, 403)
+
+    # test a token without permissions claim is rejected
+    def test_400_check_permissions(self):
+        required = permission_registry.register('get:actors')
+        verified = VerifiedToken({'sub': 'user'})
+
+        with self.assertRaises(AuthError) as error:
+            check_permissions(required, verified)
+        self.assertEqual(error.exception.status_code, 400)
+
+
+class CSVImportTestCase(unittest.TestCase):
+    ''' Tests of the CSV import that don't need the database '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'actors.csv')
+        with open(self.path, 'w') as csv_file:
+            csv_file.write('id,name,age,gender\n')
+            for i in range(1, 6):
+                csv_file.write(f'{i},actor {i},{20 + i},female\n')
+
+    # test the saved number of rows is loaded back
+    def test_checkpoint(self):
+        self.assertEqual(csv_import.load_checkpoint(self.path), 0)
+
+        csv_import.save_checkpoint(self.path, 3)
+        self.assertEqual(csv_import.load_checkpoint(self.path), 3)
+
+    # test the checkpoint of another version of the file is ignored
+    def test_checkpoint_file_changed(self):
+        csv_import.save_checkpoint(self.path, 3)
+        with open(self.path, 'a') as csv_file:
+            csv_file.write('6,actor 6,26,male\n')
+
+        self.assertEqual(csv_import.load_checkpoint(self.path), 0)
+
+    # test an unreadable checkpoint is ignored
+    def test_checkpoint_invalid(self):
+        with open(csv_import.checkpoint_path(self.path), 'w') as checkpoint:
+            checkpoint.write('{not json')
+
+        self.assertEqual(csv_import.load_checkpoint(self.path), 0)
+
+    # test the rows are read in chunks in the order of the columns
+    def test_read_chunks(self):
+        reader = [{'name': f'actor {i}', 'id': i} for i in range(5)]
+        chunks = list(csv_import.read_chunks(reader, ['id', 'name'], 2))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(chunks[0][1], [1, 'actor 1'])
+        self.assertEqual(chunks[2], [[4, 'actor 4']])
+
+    # test an import continues after the rows of the checkpoint
+    def test_resume(self):
+        csv_import.save_checkpoint(self.path, 2)
+        chunks = []
+
+        def import_chunk(connection, kind, chunk):
+            chunks.append(chunk)
+            return len(chunk)
+
+        with mock.patch.object(csv_import, 'db'), \
+                mock.patch.object(csv_import, 'import_chunk', import_chunk):
+            done, merged = csv_import.import_csv(
+                'actors', self.path, chunk_size=2, out=io.StringIO())
+
+        # only rows 3 to 5 are imported
+        self.assertEqual((done, merged), (5, 3))
+        self.assertEqual([row[0] for chunk in chunks for row in chunk],
+                         ['3', '4', '5'])
+        # the finished import removed its checkpoint
+        self.assertFalse(os.path.exists(
+            csv_import.checkpoint_path(self.path)))
+
+
+class ExportFormatTestCase(unittest.TestCase):
+    ''' Tests of the export formats on batches in memory '''
+
+    columns = ['id', 'title', 'release_date']
+    batches = [
+        [(1, 'Heat', datetime.date(1995, 12, 15)),
+         (2, 'Alien', datetime.date(1979, 5, 25))],
+        [(3, 'Up, Up', datetime.date(2009, 5, 29))]
+    ]
+
+    # test csv has a header then one line per row
+    def test_format_csv(self):
+        text = ''.join(catalog_export.format_csv(self.columns, self.batches))
+
+        self.assertEqual(text.splitlines(), [
+            'id,title,release_date',
+            '1,Heat,1995-12-15',
+            '2,Alien,1979-05-25',
+            '3,"Up, Up",2009-05-29'])
+
+    # test ndjson has one object per row
+    def test_format_ndjson(self):
+        text = ''.join(
+            catalog_export.format_ndjson(self.columns, self.batches))
+
+        self.assertEqual([json.loads(line) for line in text.splitlines()], [
+            {'id': 1, 'title': 'Heat', 'release_date': '1995-12-15'},
+            {'id': 2, 'title': 'Alien', 'release_date': '1979-05-25'},
+            {'id': 3, 'title': 'Up, Up', 'release_date': '2009-05-29'}])
+
+    # test columnar has the columns then one line per batch
+    def test_format_columnar(self):
+        text = ''.join(
+            catalog_export.format_columnar(self.columns, self.batches))
+
+        self.assertEqual([json.loads(line) for line in text.splitlines()], [
+            {'columns': self.columns},
+            {'rows': 2, 'data': [[1, 2], ['Heat', 'Alien'],
+                                 ['1995-12-15', '1979-05-25']]},
+            {'rows': 1, 'data': [[3], ['Up, Up'], ['2009-05-29']]}])
+
+    # test an empty table is only the header
+    def test_format_empty(self):
+        self.assertEqual(
+            ''.join(catalog_export.format_csv(self.columns, [])),
+            'id,title,release_date\r\n')
+        self.assertEqual(
+            ''.join(catalog_export.format_ndjson(self.columns, [])), '')
+
+
 if __name__ == "__main__":
     unittest.main()